@@ -0,0 +1,323 @@
+import os
+import sys
+import math
+import argparse
+from collections.abc import Iterable
+import numpy as np
+from numpy.typing import NDArray
+from fontTools.ttLib import TTFont
+import telemetry
+
+# Affine transforms of TrueType outlines at table level.
+#
+# The coordinates of all simple glyphs are gathered into one array, mapped
+# by their glyph's matrix and rounded with NumPy, and written back in place;
+# bounding boxes, hmtx and the head/hhea metrics are updated in the same
+# pass.  Composite glyphs keep their components, whose offsets and 2x2
+# transforms are conjugated by the map so they line up with the transformed
+# base glyphs.
+#
+# With AGAVEJP_AFFINE=1, bundle_nf.py and the transform plan of
+# modify_ibm_plex_sans_jp.py generate their fonts untransformed and apply
+# their per-glyph matrices here instead of with fontforge glyph by glyph.
+# By default (AGAVEJP_AFFINE=0) they transform in fontforge: the affine path
+# rounds twice (once when the untransformed font is written, once here), and
+# `make affine-check`, which builds both ways and compares them, has not
+# been run on the real fonts yet.
+#
+# Matrices use the psMat convention (a, b, c, d, e, f):
+#   x' = a * x + c * y + e
+#   y' = b * x + d * y + f
+# Like fontforge, the advance width is mapped only by scale/translate
+# without skew.  Glyph programs are kept as they are, so hinted fonts have
+# to be hinted again.
+#
+# affine.py transform FONT BUILD OPERATION... [--unicodes RANGES]
+# affine.py compare FONT FONT [--tolerance UNITS]
+#   Compares the outlines of the glyphs of each codepoint; exits with 1 when
+#   a point, bound or advance differs by more than the tolerance.
+
+ENABLED = os.environ.get("AGAVEJP_AFFINE", "0") != "0"
+
+Matrix = tuple[float, float, float, float, float, float]
+
+IDENTITY: Matrix = (1, 0, 0, 1, 0, 0)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Apply affine transforms to the glyf outlines of a font")
+    commands = parser.add_subparsers(dest="command", required=True)
+    transform = commands.add_parser("transform")
+    transform.add_argument("font_file")
+    transform.add_argument("build_file")
+    transform.add_argument("operations", nargs="+", metavar="OPERATION",
+                           help="scale:SX[,SY] | translate:TX,TY | skew:DEGREES | matrix:A,B,C,D,E,F "
+                                "(applied in order)")
+    transform.add_argument("--unicodes", help="only transform the glyphs of these codepoints, "
+                                              "e.g. 21-217F,2460-24EA")
+    compare = commands.add_parser("compare")
+    compare.add_argument("font_files", nargs=2, metavar="FONT")
+    compare.add_argument("--tolerance", type=float, default=1.0, help="units (default: %(default)s)")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        differences = outline_differences(*args.font_files)
+        print(format_differences(differences, args.tolerance))
+        if any(distance > args.tolerance for distance in differences.values()):
+            sys.exit(1)
+        return
+
+    matrix = IDENTITY
+    for operation in args.operations:
+        matrix = compose(matrix, parse_operation(operation))
+
+    with telemetry.stage("affine", None, [args.font_file], [args.build_file]) as record:
+        with record.phase("open"):
+            font = TTFont(args.font_file, lazy=True, recalcBBoxes=False, recalcTimestamp=False)
+        glyph_names = None
+        if args.unicodes:
+            glyph_names = cmap_glyphs(font, parse_unicodes(args.unicodes))
+        record.glyphs_in = record.glyphs_out = font["maxp"].numGlyphs
+        with record.phase("transform"):
+            transform_font(font, matrix, glyph_names)
+        with record.phase("generate"):
+            font.save(args.build_file)
+        font.close()
+    print("Transformed:", args.font_file, "->", args.build_file, flush=True)
+
+
+def parse_operation(operation: str) -> Matrix:
+    name, _, values = operation.partition(":")
+    try:
+        numbers = [float(v) for v in values.split(",")]
+        if name == "scale" and len(numbers) in (1, 2):
+            return (numbers[0], 0, 0, numbers[-1], 0, 0)
+        if name == "translate" and len(numbers) == 2:
+            return (1, 0, 0, 1, numbers[0], numbers[1])
+        if name == "skew" and len(numbers) == 1:
+            return (1, 0, math.tan(math.radians(numbers[0])), 1, 0, 0)
+        if name == "matrix" and len(numbers) == 6:
+            return tuple(numbers)  # type: ignore[return-value]
+    except ValueError:
+        pass
+    raise ValueError("Invalid operation:", operation)
+
+
+def parse_unicodes(spec: str) -> set[int]:
+    codepoints = set()
+    for item in spec.split(","):
+        start, _, end = item.strip().upper().removeprefix("U+").partition("-")
+        codepoints.update(range(int(start, 16), int(end or start, 16) + 1))
+    return codepoints
+
+
+def compose(m1: Matrix, m2: Matrix) -> Matrix:
+    # m1 then m2, like psMat.compose()
+    a1, b1, c1, d1, e1, f1 = m1
+    a2, b2, c2, d2, e2, f2 = m2
+    return (
+        a1 * a2 + b1 * c2,
+        a1 * b2 + b1 * d2,
+        c1 * a2 + d1 * c2,
+        c1 * b2 + d1 * d2,
+        e1 * a2 + f1 * c2 + e2,
+        e1 * b2 + f1 * d2 + f2,
+    )
+
+
+def cmap_glyphs(font: TTFont, codepoints: Iterable[int]) -> list[str]:
+    cmap = font.getBestCmap()
+    names = {cmap[codepoint] for codepoint in codepoints if codepoint in cmap}
+    return [name for name in font.getGlyphOrder() if name in names]
+
+
+def transform_font(font: TTFont, matrix: Matrix, glyph_names: Iterable[str] | None = None) -> None:
+    names = font.getGlyphOrder() if glyph_names is None else glyph_names
+    transform_glyphs(font, {name: matrix for name in names})
+
+
+def transform_glyphs(font: TTFont, matrices: dict[str, Matrix], advances: dict[str, int] | None = None) -> None:
+    # Maps each glyph of `matrices` by its own matrix.  `advances` sets the
+    # advance widths of glyphs (transformed or not) instead of mapping them.
+    glyf = font["glyf"]
+    hmtx = font["hmtx"]
+    advances = advances or {}
+    order = font.getGlyphOrder()
+    unknown = (matrices.keys() | advances.keys()) - set(order)
+    if unknown:
+        raise ValueError("No such glyphs:", sorted(unknown))
+    matrices = {name: tuple(matrix) for name, matrix in matrices.items()}  # type: ignore[misc]
+    _check_components(font, matrices)
+
+    simple = []
+    composite = []
+    for name in order:
+        if name not in matrices:
+            continue
+        glyph = glyf[name]
+        if glyph.isComposite():
+            composite.append(name)
+        elif glyph.numberOfContours > 0:
+            simple.append(name)
+
+    if simple:
+        # Views into the glyphs' own coordinate arrays
+        views = [np.frombuffer(glyf[name].coordinates.array, dtype=np.float64) for name in simple]
+        points = np.concatenate(views).reshape(-1, 2)
+        lengths = np.array([len(view) // 2 for view in views])
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        # The matrix of every point's glyph
+        a, b, c, d, e, f = np.repeat(np.array([matrices[name] for name in simple]), lengths, axis=0).T
+        x, y = points[:, 0], points[:, 1]
+        points = np.rint(np.stack((a * x + c * y + e, b * x + d * y + f), axis=1))
+        flat = points.ravel()
+        for view, start, length in zip(views, starts, lengths):
+            view[:] = flat[start * 2:(start + length) * 2]
+
+        mins = np.minimum.reduceat(points, starts, axis=0).astype(int)
+        maxs = np.maximum.reduceat(points, starts, axis=0).astype(int)
+        for name, (x_min, y_min), (x_max, y_max) in zip(simple, mins.tolist(), maxs.tolist()):
+            glyph = glyf[name]
+            glyph.xMin, glyph.yMin, glyph.xMax, glyph.yMax = x_min, y_min, x_max, y_max
+
+    for name in composite:
+        a, b, c, d, e, f = matrices[name]
+        _transform_components(glyf[name], np.array([[a, c], [b, d]]), np.array([e, f]))
+    for name in composite:
+        glyf[name].recalcBounds(glyf)
+
+    for name in order:
+        if name not in matrices and name not in advances:
+            continue
+        advance, lsb = hmtx[name]
+        if name in advances:
+            advance = advances[name]
+        elif _moves_width(matrices[name]):
+            a, _, _, _, e, _ = matrices[name]
+            advance = max(0, int(np.rint(a * advance + e)))
+        glyph = glyf[name]
+        if glyph.numberOfContours != 0:
+            lsb = glyph.xMin
+        hmtx[name] = (advance, lsb)
+
+    _update_font_bounds(font)
+
+
+def _moves_width(matrix: Matrix) -> bool:
+    a, b, c, d, _, _ = matrix
+    return b == 0 and c == 0 and a > 0 and d > 0
+
+
+def _transform_components(glyph, linear: NDArray, offset: NDArray) -> None:
+    # With the base glyphs mapped by A(p) = L p + t, a component drawn as
+    # M p + o becomes M' A(p) + o' with M' = L M L^-1 and o' = L o + t - M' t
+    inverse = np.linalg.inv(linear)
+    for component in glyph.components:
+        if hasattr(component, "transform"):
+            # fontTools stores the transposed matrix (row vectors)
+            m = np.array(component.transform, dtype=float).T
+        else:
+            m = np.identity(2)
+        conjugated = linear @ m @ inverse
+        if not np.allclose(conjugated, np.identity(2)):
+            component.transform = conjugated.T.tolist()
+        elif hasattr(component, "transform"):
+            del component.transform
+        if hasattr(component, "x"):
+            x, y = linear @ (component.x, component.y) + offset - conjugated @ offset
+            component.x, component.y = int(np.rint(x)), int(np.rint(y))
+        # Otherwise the component is point-matched (firstPt/secondPt): it is
+        # placed by its anchor points, which move with the glyphs
+
+
+def _check_components(font: TTFont, matrices: dict[str, Matrix]) -> None:
+    # Composites and their components have to be transformed together, by
+    # the same matrix
+    glyf = font["glyf"]
+    for name in font.getGlyphOrder():
+        glyph = glyf[name]
+        if not glyph.isComposite():
+            continue
+        for component in glyph.components:
+            if matrices.get(name) != matrices.get(component.glyphName):
+                raise ValueError("Composite and component not transformed together:",
+                                 name, component.glyphName)
+
+
+def _update_font_bounds(font: TTFont) -> None:
+    glyf = font["glyf"]
+    bounds = [(g.xMin, g.yMin, g.xMax, g.yMax)
+              for g in (glyf[name] for name in font.getGlyphOrder())
+              if g.numberOfContours != 0]
+    head = font["head"]
+    if bounds:
+        array = np.array(bounds)
+        head.xMin, head.yMin = array[:, :2].min(axis=0).tolist()
+        head.xMax, head.yMax = array[:, 2:].max(axis=0).tolist()
+    font["hhea"].recalc(font)
+
+
+def outline_differences(font_file_a: str, font_file_b: str) -> dict[str, float]:
+    # "U+XXXX" -> largest difference of its glyph's points, bounds and
+    # advance in font units (inf when the glyph is missing from one font or
+    # the point structure differs)
+    fonts = [TTFont(font_file, lazy=True) for font_file in (font_file_a, font_file_b)]
+    cmaps = [font.getBestCmap() for font in fonts]
+    differences = {}
+    for codepoint in sorted(cmaps[0].keys() | cmaps[1].keys()):
+        label = f"U+{codepoint:04X}"
+        if codepoint not in cmaps[0] or codepoint not in cmaps[1]:
+            differences[label] = math.inf
+            continue
+        glyphs = []
+        for font, cmap in zip(fonts, cmaps):
+            name = cmap[codepoint]
+            glyph = font["glyf"][name]
+            coordinates, ends, flags = glyph.getCoordinates(font["glyf"])
+            bounds = (glyph.xMin, glyph.yMin, glyph.xMax, glyph.yMax) if glyph.numberOfContours != 0 else (0, 0, 0, 0)
+            glyphs.append((_expand_implied(list(coordinates), ends, flags), bounds, font["hmtx"][name][0]))
+        (contours_a, bounds_a, advance_a), (contours_b, bounds_b, advance_b) = glyphs
+        distance = max(abs(advance_a - advance_b), *(abs(p - q) for p, q in zip(bounds_a, bounds_b)))
+        if [len(contour) for contour in contours_a] != [len(contour) for contour in contours_b]:
+            distance = math.inf
+        elif contours_a:
+            distance = max(distance, *(float(np.abs(np.array(a) - np.array(b)).max())
+                                       for a, b in zip(contours_a, contours_b)))
+        differences[label] = float(distance)
+    for font in fonts:
+        font.close()
+    return differences
+
+
+def _expand_implied(coordinates: list, ends: list[int], flags) -> list[list[tuple[float, float]]]:
+    # Contours with the implied on-curve points between two off-curve points
+    # made explicit, since which of them are stored depends on the rounding
+    contours = []
+    start = 0
+    for end in ends:
+        points = coordinates[start:end + 1]
+        on_curve = [flag & 0x01 for flag in flags[start:end + 1]]
+        contour = []
+        for i, point in enumerate(points):
+            previous = i - 1
+            if not on_curve[i] and not on_curve[previous]:
+                (x0, y0), (x1, y1) = points[previous], point
+                contour.append(((x0 + x1) / 2, (y0 + y1) / 2))
+            contour.append(tuple(point))
+        contours.append(contour)
+        start = end + 1
+    return contours
+
+
+def format_differences(differences: dict[str, float], tolerance: float) -> str:
+    over = {label: distance for label, distance in differences.items() if distance > tolerance}
+    exact = sum(1 for distance in differences.values() if distance == 0)
+    lines = [f"{len(differences)} glyphs: {exact} identical, "
+             f"{len(differences) - exact - len(over)} within {tolerance:g} units, {len(over)} over"]
+    for label, distance in over.items():
+        lines.append(f"  {label} " + ("missing or different points" if math.isinf(distance) else f"{distance:g}"))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+import sys
+import os
+import json
+import shutil
+import argparse
+import subprocess
+from os.path import join, dirname, abspath, basename, exists
+from fontTools import subset
+from fontTools.ttLib import TTFont
+import telemetry
+from bundle_nf import SOURCES_INFO
+
+# Benchmark of every pipeline stage.
+#
+# The stages are run one by one, as `make` would run them, on small fixture
+# fonts subset from `resources/glyphs` (or on the full fonts with --full).
+# The telemetry records of the runs are collected into a results file and
+# compared against a baseline, so regressions in time, memory and output
+# size show up per commit.
+
+ROOT_DIR = abspath(join(dirname(__file__), "..", ".."))
+SRC_DIR = join(ROOT_DIR, "src")
+GLYPHS_DIR = join(ROOT_DIR, "resources", "glyphs")
+BENCH_DIR = join(ROOT_DIR, ".cache", "bench")
+BASELINE_FILE = join(ROOT_DIR, "bench", "baseline.json")
+
+# Relative increase over the baseline reported as a regression
+TOLERANCE = {"wall_time": 0.2, "peak_rss_kb": 0.1, "output_size": 0.02}
+
+FIXTURE_HACK_UNICODES = [*range(0x20, 0x7f), 0x2003, 0x266a, *range(0xe0a0, 0xe0b4)]
+FIXTURE_IBM_UNICODES = [
+    *range(0x20, 0x7f),
+    *range(0x3000, 0x3020),  # CJK symbols
+    *range(0x3041, 0x3097),  # hiragana
+    *range(0x4e00, 0x4e40),  # kanji
+    *range(0xff01, 0xff21),  # fullwidth forms
+    0x2003, 0x2103, 0x2109, 0x2121, 0x212b, 0x266a, 0xfb01, 0xfb02,
+]
+# Glyphs modify_ibm_plex_sans_jp.py and merge.py look up by name
+FIXTURE_IBM_GLYPHS = [
+    ".notdef", "section", "dagger.prop", "daggerdbl.prop", "paragraph",
+    "perthousand.full", "degree", "plusminus", "multiply", "divide",
+    "zero.zero", "uni51F0", "a.alt01", "g.alt01", "g.alt02", "zero.alt01",
+    "minus", "uni301F.half", "acute.half",
+]
+# Features modify_ibm_plex_sans_jp.py works on; the others would pull
+# hundreds of alternates into the fixture
+FIXTURE_IBM_FEATURES = ["ccmp", "liga", "vert", "vrt2", "halt", "vhal", "palt", "vpal", "kern", "vkrn"]
+FIXTURE_NF_GLYPHS_PER_RANGE = 200
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the build stages")
+    parser.add_argument("--full", action="store_true", help="run on the full-size fonts")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="baseline file to compare with")
+    parser.add_argument("--update-baseline", action="store_true", help="write the results to the baseline file")
+    parser.add_argument("--check", action="store_true", help="exit with 1 on regressions")
+    args = parser.parse_args()
+
+    mode = "full" if args.full else "fixture"
+    work_dir = join(BENCH_DIR, mode)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir)
+
+    glyphs_dir = GLYPHS_DIR if args.full else make_fixtures(join(work_dir, "glyphs"))
+    results = run(glyphs_dir, work_dir, mode)
+    with open(join(BENCH_DIR, f"results-{mode}.json"), "w") as f:
+        json.dump(results, f, indent=2)
+
+    baseline = load_baseline(args.baseline)
+    regressions = compare(baseline.get(mode), results)
+    print(report(baseline.get(mode), results))
+
+    if args.update_baseline:
+        baseline[mode] = results
+        os.makedirs(dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2)
+            f.write("\n")
+
+    for regression in regressions:
+        print("Regression:", regression, flush=True)
+    if args.check and regressions:
+        sys.exit(1)
+
+
+def make_fixtures(fixture_dir: str) -> str:
+    os.makedirs(fixture_dir)
+    for weight in ("Regular", "Bold"):
+        subset_font(join(GLYPHS_DIR, f"Agave-{weight}.ttf"),
+                    join(fixture_dir, f"Agave-{weight}.ttf"),
+                    FIXTURE_HACK_UNICODES)
+    for weight in ("Medium", "Bold"):
+        subset_font(join(GLYPHS_DIR, f"IBMPlexSansJP-{weight}.ttf"),
+                    join(fixture_dir, f"IBMPlexSansJP-{weight}.ttf"),
+                    FIXTURE_IBM_UNICODES, FIXTURE_IBM_GLYPHS, FIXTURE_IBM_FEATURES)
+
+    # Only sources copied as is (no remaps, no modify script) can be cut
+    # down without changing what bundle_nf.py expects from them.
+    nf_dir = join(fixture_dir, "FontPatcher-glyphs")
+    for info in SOURCES_INFO:
+        source = join(GLYPHS_DIR, "FontPatcher-glyphs", info["path"])
+        fixture = join(nf_dir, info["path"])
+        os.makedirs(dirname(fixture), exist_ok=True)
+        if "modify" in info or any(remap is not None for remap in info["remaps"]):
+            shutil.copyfile(source, fixture)
+            continue
+        unicodes = []
+        for range_ in info["ranges"]:
+            start = range_[0]
+            stop = range_[-1] + 1
+            unicodes.extend(range(start, min(stop, start + FIXTURE_NF_GLYPHS_PER_RANGE)))
+        subset_font(source, fixture, unicodes)
+    return fixture_dir
+
+
+def subset_font(font_file: str,
+                fixture_file: str,
+                unicodes: list[int],
+                glyphs: list[str] | None = None,
+                features: list[str] | None = None) -> None:
+    options = subset.Options()
+    options.glyph_names = True
+    options.notdef_outline = True
+    options.hinting = True
+    options.layout_features = features or ["*"]
+    options.name_IDs = ["*"]
+    options.name_languages = ["*"]
+    options.legacy_kern = True
+    font = TTFont(font_file)
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(unicodes=unicodes, glyphs=glyphs or [])
+    subsetter.subset(font)
+    font.save(fixture_file)
+
+
+def stage_commands(glyphs_dir: str, cache_dir: str, build_dir: str) -> list[tuple[str, list[str]]]:
+    def script(name: str) -> str:
+        return join(SRC_DIR, name)
+
+    def cached(name: str) -> str:
+        return join(cache_dir, name)
+
+    return [
+        ("modify_hack", [script("fontforge_/modify_hack.py"),
+                         join(glyphs_dir, "Agave-Regular.ttf"), cached("modified-Hack-Regular.ttf")]),
+        ("presubset_ibm", [script("fonttools_/presubset_ibm.py"),
+                           join(glyphs_dir, "IBMPlexSansJP-Medium.ttf"), cached("presubset-IBMPlexSansJP-Medium.ttf")]),
+        ("modify_ibm_plex_sans_jp", [script("fontforge_/modify_ibm_plex_sans_jp.py"),
+                                     cached("presubset-IBMPlexSansJP-Medium.ttf"),
+                                     cached("modified-IBMPlexSansJP-Medium.ttf")]),
+        ("merge", [script("fontforge_/merge.py"),
+                   cached("modified-Hack-Regular.ttf"), cached("modified-IBMPlexSansJP-Medium.ttf"),
+                   "Regular", cached("merged-AgaveJP-Regular.ttf"), cached("merged-AgaveJP-Italic.ttf")]),
+        ("bundle_nf", [script("fontforge_/bundle_nf.py"),
+                       join(glyphs_dir, "FontPatcher-glyphs"), cached("NerdFonts.ttf")]),
+        ("braille_gen", [script("fontforge_/braille_gen.py"), cached("Braille.ttf")]),
+        ("patch", [script("fontforge_/patch.py"),
+                   cached("merged-AgaveJP-Regular.ttf"), cached("NerdFonts.ttf"), cached("Braille.ttf"),
+                   cached("AgaveJP-Regular.ttf")]),
+        ("fonttools", [script("fonttools_/main.py"), build_dir, cached("merged-AgaveJP-Regular.ttf"),
+                       "--patch", cached("NerdFonts.ttf"), cached("Braille.ttf")]),
+    ]
+
+
+def run(glyphs_dir: str, work_dir: str, mode: str) -> dict:
+    cache_dir = join(work_dir, "cache")
+    build_dir = join(work_dir, "build")
+    telemetry_dir = join(work_dir, "telemetry")
+    for directory in (cache_dir, build_dir):
+        os.makedirs(directory)
+
+    env = {
+        **os.environ,
+        "AGAVEJP_CACHE": "0",
+        "AGAVEJP_TELEMETRY": "1",
+        "AGAVEJP_TELEMETRY_DIR": telemetry_dir,
+    }
+    for name, command in stage_commands(glyphs_dir, cache_dir, build_dir):
+        print("Benchmark:", name, flush=True)
+        subprocess.run([sys.executable, *command], env=env, check=True, cwd=ROOT_DIR)
+
+    stages = {}
+    for record in telemetry.load_records(telemetry_dir):
+        # Shard records are included in their stage's numbers
+        if record["stage"] == "bundle_nf_shard":
+            continue
+        stages[record["stage"]] = {
+            "wall_time": record["wall_time"],
+            "cpu_time": record["cpu_time"],
+            "peak_rss_kb": max(record["peak_rss_kb"], record["peak_rss_children_kb"]),
+            "output_size": sum(output["size"] or 0 for output in record["outputs"]),
+            "glyphs_out": record["glyphs_out"],
+            "phases": record["phases"],
+        }
+    return {"commit": git_commit(), "mode": mode, "stages": stages}
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT_DIR, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_baseline(baseline_file: str) -> dict:
+    if not exists(baseline_file):
+        return {}
+    with open(baseline_file) as f:
+        return json.load(f)
+
+
+def compare(baseline: dict | None, results: dict) -> list[str]:
+    if baseline is None:
+        return []
+    regressions = []
+    for stage, values in results["stages"].items():
+        base = baseline["stages"].get(stage)
+        if base is None:
+            continue
+        for metric, tolerance in TOLERANCE.items():
+            if base[metric] and values[metric] > base[metric] * (1 + tolerance):
+                regressions.append(f"{stage} {metric}: {base[metric]} -> {values[metric]}")
+    return regressions
+
+
+def report(baseline: dict | None, results: dict) -> str:
+    lines = [f"{'stage':<24} {'wall[s]':>9} {'cpu[s]':>9} {'rss[MB]':>9} {'size[KB]':>9}  baseline({basename(BASELINE_FILE)})"]
+    for stage, v in results["stages"].items():
+        line = (f"{stage:<24} {v['wall_time']:>9.2f} {v['cpu_time']:>9.2f} "
+                f"{v['peak_rss_kb'] / 1024:>9.0f} {v['output_size'] / 1024:>9.0f}")
+        base = (baseline or {}).get("stages", {}).get(stage)
+        if base:
+            line += f"  {base['wall_time']:.2f}s {base['peak_rss_kb'] / 1024:.0f}MB {base['output_size'] / 1024:.0f}KB"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,91 +3,136 @@
 import sys
 from os.path import join, dirname
 import json
-from math import sin, cos, pi as PI
+from math import pi as PI
 import numpy as np
 from numpy.typing import NDArray
 import fontforge
 import util
+import cache
+import subset
+import telemetry
 import properties as P
 
-if len(sys.argv) != 2:
-    raise ValueError("Invalid argument")
-
 BRAILLE_JSON_PATH = join(dirname(__file__), "braille.json")
-BUILD_FILE = sys.argv[1]
+# Units of the coordinates in braille.json
+BRAILLE_JSON_EM = 2048
+DOT_RADIUS = 100
 
 
 def main() -> None:
-    font = new_font()
-
+    if len(sys.argv) != 2:
+        raise ValueError("Invalid argument")
+    build_file = sys.argv[1]
+
+    key = cache.stage_key(
+        "braille_gen",
+        [BRAILLE_JSON_PATH],
+        [sys.modules[__name__], util, subset],
+        {**cache.constants(P, "ASCENT", "DESCENT", "EM", "ENCODING",
+                           "UNDERLINE_POS", "UNDERLINE_HEIGHT"),
+         "subset": subset.digest()},
+        fontforge.version(),
+    )
+    with telemetry.stage("braille_gen", None, [BRAILLE_JSON_PATH], [build_file]) as record:
+        if cache.restore(key, [build_file]):
+            record.cached = True
+            util.log("Restored:", build_file)
+            return
+
+        with record.phase("transform"):
+            font = build()
+        record.glyphs_out = util.font_glyph_count(font)
+        with record.phase("generate"):
+            util.font_into_file(font, build_file)
+        cache.store(key, [build_file])
+    util.log("Generated:", build_file)
+
+
+def build(table: dict[str, list[int]] | None = None,
+          radius: float | None = None,
+          ascent: int = P.ASCENT,
+          descent: int = P.DESCENT):
+    # `table` (dot number -> center) and `radius` are in units of the
+    # generated font.  By default they are scaled from braille.json.
+    em = ascent + descent
     with open(BRAILLE_JSON_PATH, "r") as f:
         braille_json = json.load(f)
-    table = braille_json['table']
-    for data in braille_json['data']:
-        code = int(data['code'], 16)
-        points = [table[str(p)] for p in data['points']]
-        create_braille(font, code, points)
+    if table is None:
+        scale = em / BRAILLE_JSON_EM
+        table = {k: [v[0] * scale, v[1] * scale] for k, v in braille_json['table'].items()}
+    if radius is None:
+        radius = DOT_RADIUS * em / BRAILLE_JSON_EM
+
+    entries = [data for data in braille_json['data'] if subset.contains(int(data['code'], 16))]
+    codes = [int(data['code'], 16) for data in entries]
+    patterns = [data['points'] for data in entries]
+    outlines = braille_outlines(table, patterns, radius, descent)
+
+    font = new_font(ascent, descent)
+    for code, circles in zip(codes, outlines):
+        create_braille(font, code, circles, em // 2)
+    return font
 
-    util.font_into_file(font, BUILD_FILE)
-    util.log("Generated:", BUILD_FILE)
 
+def braille_outlines(table: dict[str, list[int]],
+                     patterns: list[list[int]],
+                     radius: float,
+                     descent: int) -> list[NDArray]:
+    # Points of every circle of every pattern, computed in one batch.
+    # Returns an (dots, 13, 2) array per pattern.
+    if not patterns:
+        return []
+    dot_numbers = [str(p) for pattern in patterns for p in pattern]
+    centers = np.array([table[n] for n in dot_numbers], dtype=float) - [0, descent]
+    points = np.rint(centers[:, np.newaxis, :] + radius * circle_template()).astype(int)
+
+    splits = np.cumsum([len(pattern) for pattern in patterns])[:-1]
+    return np.split(points, splits)
+
+
+def circle_template() -> NDArray:
+    # Bezier circle of radius 1 around the origin: start point followed by
+    # (control1, control2, end) for each quadrant, clockwise from (1, 0).
+    # The control points are where the tangents at the quadrant ends cross
+    # the tangent at the midpoint of a circle 1.1 times as large.
+    angles = -np.arange(5) * PI / 2
+    ends = np.stack([np.cos(angles), np.sin(angles)], axis=1)
+    mid_angles = -(2 * np.arange(4) + 1) * PI / 4
+    mids = np.stack([np.cos(mid_angles), np.sin(mid_angles)], axis=1)
+
+    # Solve n1 . X = 1 and n2 . X = 1.1 for the 8 control points at once
+    normals = np.stack([
+        np.stack([ends[:-1], mids], axis=1),
+        np.stack([ends[1:], mids], axis=1),
+    ], axis=1).reshape(-1, 2, 2)
+    rhs = np.tile([1, 1.1], (8, 1))[:, :, np.newaxis]
+    controls = np.linalg.solve(normals, rhs)[:, :, 0].reshape(4, 2, 2)
+
+    template = [ends[0]]
+    for i in range(4):
+        template.extend([controls[i, 0], controls[i, 1], ends[i + 1]])
+    return np.array(template)
 
-def create_braille(font, codepoint: int, points: list[tuple[int, int]]) -> None:
+
+def create_braille(font, codepoint: int, circles: NDArray, width: int) -> None:
     glyph = font.createChar(codepoint, "uni" + (hex(codepoint)[2:]))
     pen = glyph.glyphPen()
-    for point in points:
-        center_pos = np.array([point[0], point[1] - P.DESCENT])
-        draw_circle(pen, center_pos, 100)
+    for circle in circles.tolist():
+        points = [tuple(point) for point in circle]
+        pen.moveTo(points[0])
+        for i in range(1, len(points), 3):
+            pen.curveTo(points[i], points[i + 1], points[i + 2])
+        pen.closePath()
     pen = None
-    glyph.width = P.EM // 2
+    glyph.width = width
     glyph.round()
 
 
-def draw_circle(pen, center_pos: NDArray, radius: int) -> None:
-    def vector_from_rad(rad: float) -> NDArray:
-        return np.array([cos(rad), sin(rad)])
-
-    def intersection(normal_vec1: NDArray, pos1: NDArray, normal_vec2: NDArray, pos2: NDArray) -> tuple[int, int]:
-        # a(x - x1) + b(y - y1) = 0 <=> ax + by = ax1 + by1
-        # c(x - x2) + d(y - y2) = 0 <=> cx + by = cx2 + by2
-        #  ∴ A X = K
-        #      X = A^-1 K
-        a, b = normal_vec1
-        c, d = normal_vec2
-        x1, y1 = pos1
-        x2, y2 = pos2
-        mat_A = np.matrix([
-            [a, b],
-            [c, d]
-        ])
-        vec_K = np.array([
-            a * x1 + b * y1,
-            c * x2 + d * y2
-        ])
-        mat_X = mat_A.I @ vec_K
-        return (round(mat_X[0, 0]), round(mat_X[0, 1]))
-
-    for i in range(4):
-        vec1 = vector_from_rad(-1 * i * PI / 2)
-        vec2 = vector_from_rad(-1 * (i + 1) * PI / 2)
-        vec3 = vector_from_rad(-1 * (2 * i + 1) * PI / 4)
-        pos1 = center_pos + (vec1 * radius)
-        pos2 = center_pos + (vec2 * radius)
-        pos3 = center_pos + (vec3 * radius * 1.1)
-
-        curve_point1 = intersection(vec1, pos1, vec3, pos3)
-        curve_point2 = intersection(vec2, pos2, vec3, pos3)
-        if i == 0:
-            pen.moveTo(pos1)
-        pen.curveTo(curve_point1, curve_point2, pos2)
-    pen.closePath()
-
-
-def new_font():
+def new_font(ascent: int = P.ASCENT, descent: int = P.DESCENT):
     familyname = "Braille"
     font = fontforge.font()
-    font.ascent = P.ASCENT
-    font.descent = P.DESCENT
+    font.ascent = ascent
+    font.descent = descent
     font.italicangle = 0
     font.upos = P.UNDERLINE_POS
     font.uwidth = P.UNDERLINE_HEIGHT
@@ -1,24 +1,26 @@
 # pyright: reportMissingImports=false
 
 import sys
+import os
 import ast
-from os.path import join, basename, splitext
+import tempfile
+import multiprocessing
+from os.path import join, basename, splitext, dirname
 from typing import Final, TypedDict
 from collections.abc import Callable
 import fontforge
 import psMat
+from fontTools.ttLib import TTFont
 import util
+import affine
+import cache
+import subset
+import telemetry
 import properties as P
 
-if len(sys.argv) != 3:
-    raise ValueError("Invalid argument")
-
-GLYPHS_PATH = sys.argv[1]
-BUILD_FILE = sys.argv[2]
-
 #  {
 #      path: string
-#          Path to the ttf/otf files.
+#          Path to the ttf/otf files (relative to the FontPatcher glyphs directory).
 #      ranges: list<(int, int)>
 #          Locations in nerd font.
 #      remaps: list<(int, int)>
@@ -50,14 +52,14 @@ class SourceInfo(SourceInfoRequiredKeys, SourceInfoOptionalKeys):
 
 SOURCES_INFO: Final[list[SourceInfo]] = [
     {   # Seti-UI + Custom
-        "path": join(GLYPHS_PATH, "original-source.otf"),
+        "path": "original-source.otf",
         "ranges": [(0xe5fa, 0xe6ad)],
         "remaps": [(0xe4fa, 0xe5ad)],
         "scale": (0.83, 0.83),
         "translate": (-310, -140)
     },
     {   # Devicons (https://vorillaz.github.io/devicons/)
-        "path": join(GLYPHS_PATH, "devicons.ttf"),
+        "path": "devicons.ttf",
         "ranges": [(0xe700, 0xe7c5)],
         "remaps": [(0xe600, 0xe6c5)],
         "scale": (0.9, 0.9),
@@ -74,7 +76,7 @@ SOURCES_INFO: Final[list[SourceInfo]] = [
                 """
     },
     {   # Font Awesome (https://github.com/FortAwesome/Font-Awesome)
-        "path": join(GLYPHS_PATH, "font-awesome", "FontAwesome.otf"),
+        "path": join("font-awesome", "FontAwesome.otf"),
         "ranges": [(0xf000, 0xf2e0)],
         "remaps": [None],
         "scale": (0.8, 0.8),
@@ -92,21 +94,21 @@ SOURCES_INFO: Final[list[SourceInfo]] = [
                 """
     },
     {   # Font Awesome Extension (https://github.com/AndreLZGava/font-awesome-extension)
-        "path": join(GLYPHS_PATH, "font-awesome-extension.ttf"),
+        "path": "font-awesome-extension.ttf",
         "ranges": [(0xe200, 0xe2a9)],
         "remaps": [(0xe000, 0xe0a9)],
         "scale": (0.8, 0.8),
         "translate": (-310, -80)
     },
     {   # Material Design Icons (https://github.com/Templarian/MaterialDesign)
-        "path": join(GLYPHS_PATH, "materialdesign", "MaterialDesignIconsDesktop.ttf"),
+        "path": join("materialdesign", "MaterialDesignIconsDesktop.ttf"),
         "ranges": [(0xf0001, 0xf1af0)],
         "remaps": [None],
         "scale": (0.9, 0.9),
         "translate": (-410, 0)
     },
     {   # Weather (https://github.com/erikflowers/weather-icons)
-        "path": join(GLYPHS_PATH, "weather-icons", "weathericons-regular-webfont.ttf"),
+        "path": join("weather-icons", "weathericons-regular-webfont.ttf"),
         "ranges": [(0xe300, 0xe3e3)],
         "remaps": [(0xf000, 0xf0eb)],
         "scale": (0.9, 0.9),
@@ -123,7 +125,7 @@ SOURCES_INFO: Final[list[SourceInfo]] = [
                 """
     },
     {   # Octicons (https://github.com/primer/octicons)
-        "path": join(GLYPHS_PATH, "octicons", "octicons.ttf"),
+        "path": join("octicons", "octicons.ttf"),
         "ranges": [(0xf400, 0xf532), (0x2665,), (0x26a1,)],
         "remaps": [(0xf000, 0xf305), None, None],
         "scale": (0.695, 0.695),
@@ -133,7 +135,7 @@ SOURCES_INFO: Final[list[SourceInfo]] = [
                 """
     },
     {   # Powerline Symbols
-        "path": join(GLYPHS_PATH, "powerline-symbols", "PowerlineSymbols.otf"),
+        "path": join("powerline-symbols", "PowerlineSymbols.otf"),
         "ranges": [(0xe0a0, 0xe0a2), (0xe0b0, 0xe0b3)],
         "remaps": [None, None],
         "scale": (0.97, 0.887),
@@ -143,7 +145,7 @@ SOURCES_INFO: Final[list[SourceInfo]] = [
                 """
     },
     {   # Powerline Extra Symbols (https://github.com/ryanoasis/powerline-extra-symbols)
-        "path": join(GLYPHS_PATH, "PowerlineExtraSymbols.otf"),
+        "path": "PowerlineExtraSymbols.otf",
         "ranges": [(0xe0a3,), (0xe0b4, 0xe0c8), (0xe0ca,), (0xe0cc, 0xe0d4)],
         "remaps": [None, None, None, None],
         "scale": (1, 1),
@@ -161,21 +163,21 @@ SOURCES_INFO: Final[list[SourceInfo]] = [
                 """
     },
     {   # IEC Power Symbols (https://unicodepowersymbol.com/)
-        "path": join(GLYPHS_PATH, "Unicode_IEC_symbol_font.otf"),
+        "path": "Unicode_IEC_symbol_font.otf",
         "ranges": [(0x23fb, 0x23fe), (0x2b58,)],
         "remaps": [None, None],
         "scale": (0.8, 0.8),
         "translate": (-280, -100),
     },
     {   # Font Logos (https://github.com/Lukas-W/font-logos)
-        "path": join(GLYPHS_PATH, "font-logos.ttf"),
+        "path": "font-logos.ttf",
         "ranges": [(0xf300, 0xf32f)],
         "remaps": [None],
         "scale": (0.73, 0.73),
         "translate": (0, 150)
     },
     {   # Pomicons (https://github.com/gabrielelana/pomicons)
-        "path": join(GLYPHS_PATH, "Pomicons.otf"),
+        "path": "Pomicons.otf",
         "ranges": [(0xe000, 0xe00a)],
         "remaps": [None],
         "scale": (0.87, 0.87),
@@ -186,7 +188,7 @@ SOURCES_INFO: Final[list[SourceInfo]] = [
                 """
     },
     {   # Codicons (https://github.com/microsoft/vscode-codicons)
-        "path": join(GLYPHS_PATH, "codicons", "codicon.ttf"),
+        "path": join("codicons", "codicon.ttf"),
         "ranges": [(0xea60, 0xebeb)],
         "remaps": [None],
         "scale": (0.8, 0.8),
@@ -198,53 +200,141 @@ SOURCES_INFO: Final[list[SourceInfo]] = [
     }
 ]
 
+# Number of processes building the shards, from BUNDLE_NF_WORKERS (default: CPU count)
+WORKERS = int(os.environ.get("BUNDLE_NF_WORKERS", "0")) or os.cpu_count() or 1
 
-def main() -> None:
-    font = new_font()
-    for info in SOURCES_INFO:
-        source = fontforge.open(info["path"])
-        source.em = P.EM
-        transform_all(source, info["scale"], info["translate"])
-
-        ranges = info["ranges"]
-        remaps = info["remaps"]
-        if len(ranges) != len(remaps):
-            raise ValueError("len(ranges):", len(ranges), "len(remaps):", len(remaps))
-
-        for i in range(len(ranges)):
-            remap_range(source, remaps[i], ranges[i])
-        if "modify" in info:
-            modify(source, info["modify"])
-        for i in range(len(ranges)):
-            copy_range(font, source, ranges[i])
 
+def main() -> None:
+    if len(sys.argv) != 3:
+        raise ValueError("Invalid argument")
+    glyphs_path = sys.argv[1]
+    build_file = sys.argv[2]
+    familyname = splitext(basename(build_file))[0]
+    shard_dir = join(dirname(build_file), familyname + "-shards")
+
+    sources = [join(glyphs_path, info["path"]) for info in SOURCES_INFO]
+    with telemetry.stage("bundle_nf", None, sources, [build_file]) as record:
+        with record.phase("transform"):
+            font = build(glyphs_path, familyname, shard_dir)
+        record.glyphs_out = util.font_glyph_count(font)
+        with record.phase("generate"):
+            generate(font, build_file)
+    util.log("Generated:", build_file)
+
+
+def build(glyphs_path: str, familyname: str = "NerdFonts", shard_dir: str | None = None):
+    # Every source is built into its own cached shard, then the shards are
+    # combined.  The glyphs are not transformed yet (see `generate()` and
+    # `transform()`).
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        shard_dir = shard_dir or tmp_dir
+        os.makedirs(shard_dir, exist_ok=True)
+        shard_files = build_shards(glyphs_path, shard_dir)
+        return combine(familyname, shard_files)
+
+
+def build_shards(glyphs_path: str, shard_dir: str, workers: int = WORKERS) -> list[str]:
+    jobs = []
+    for i, info in enumerate(SOURCES_INFO):
+        # Fail on invalid modify scripts before any source is opened
+        compile_modify(info)
+        shard_file = join(shard_dir, f"{i:02}-{splitext(basename(info['path']))[0]}.sfd")
+        jobs.append((glyphs_path, info, shard_file))
+
+    with multiprocessing.get_context("fork").Pool(workers) as pool:
+        return pool.starmap(build_shard, jobs)
+
+
+def build_shard(glyphs_path: str, info: SourceInfo, shard_file: str) -> str:
+    source_file = join(glyphs_path, info["path"])
+    key = cache.stage_key(
+        "bundle_nf_shard",
+        [source_file],
+        [util, subset],
+        {
+            # The shards are not transformed, so scale, translate and modify
+            # are left out and only the code building them is hashed
+            "ranges": info["ranges"],
+            "remaps": info["remaps"],
+            "code": cache.functions_digest(build_shard, _build_shard_font, new_font, remap_range,
+                                           _remap_util, copy_range, _tuple_to_range),
+            "subset": subset.digest(),
+            **cache.constants(P, "ASCENT", "DESCENT", "EM", "ENCODING",
+                              "UNDERLINE_POS", "UNDERLINE_HEIGHT"),
+        },
+        fontforge.version(),
+    )
+    with telemetry.stage("bundle_nf_shard", basename(info["path"]), [source_file], [shard_file]) as record:
+        if cache.restore(key, [shard_file]):
+            record.cached = True
+            util.log("Restored:", info["path"], "->", shard_file)
+            return shard_file
+
+        if not subset.intersects(cp for range_ in info["ranges"] for cp in _tuple_to_range(range_)):
+            # Nothing of this source is in the subset
+            font = new_font(splitext(basename(shard_file))[0])
+            font.save(shard_file)
+            font.close()
+            return shard_file
+
+        with record.phase("open"):
+            source = fontforge.open(source_file)
+        record.glyphs_in = util.font_glyph_count(source)
+        with record.phase("transform"):
+            font = _build_shard_font(source, info, splitext(basename(shard_file))[0])
         source.close()
-        util.log("Bundled:", info["path"], "->", BUILD_FILE)
+        record.glyphs_out = util.font_glyph_count(font)
+        with record.phase("generate"):
+            # SFD keeps the outlines as they are, without TrueType conversion
+            font.save(shard_file)
+        font.close()
+        cache.store(key, [shard_file])
+    util.log("Bundled:", info["path"], "->", shard_file)
+    return shard_file
+
+
+def _build_shard_font(source, info: SourceInfo, familyname: str):
+    font = new_font(familyname)
+    source.em = P.EM
+
+    ranges = info["ranges"]
+    remaps = info["remaps"]
+    if len(ranges) != len(remaps):
+        raise ValueError("len(ranges):", len(ranges), "len(remaps):", len(remaps))
+
+    # Glyph presence is looked up in this index instead of probing the font
+    present = util.font_encoded_slots(source)
+    for i in range(len(ranges)):
+        remap_range(source, present, remaps[i], ranges[i])
+    for i in range(len(ranges)):
+        copy_range(font, source, present, ranges[i])
+
+    # The transforms only scale and move, so the extrema stay extrema
+    util.fix_all_glyph_points(font, addExtrema=True)
+    return font
+
 
-    util.fix_all_glyph_points(font, round=True, addExtrema=True)
-    util.font_into_file(font, BUILD_FILE)
-    util.log("Generated:", BUILD_FILE)
+def combine(familyname: str, shard_files: list[str]):
+    font = new_font(familyname)
+    # Merged in reverse order: mergeFonts() keeps existing glyphs, so later
+    # sources win like they did when they were pasted in order.
+    for shard_file in reversed(shard_files):
+        font.mergeFonts(shard_file)
+    return font
 
 
-def remap_range(font, from_range: tuple[int, int] | None, to_range: tuple[int, int]) -> None:
+def remap_range(font, present: set[int], from_range: tuple[int, int] | None, to_range: tuple[int, int]) -> None:
     if from_range is None:
         return
     next_to_codepoint, next_from_codepoint = _remap_util(
-        font, from_range, to_range
+        present, from_range, to_range
     )
 
+    pairs = []
     to_codepoint = next_to_codepoint()
     from_codepoint = next_from_codepoint()
     while to_codepoint and from_codepoint:
-        font.selection.select(from_codepoint)
-        font.copy()
-        font.selection.select(to_codepoint)
-        font.paste()
-        try:
-            font[to_codepoint].glyphname = font[from_codepoint].glyphname
-        except TypeError as e:
-            if str(e) != "No such glyph":
-                raise
+        pairs.append((from_codepoint, to_codepoint))
         to_codepoint = next_to_codepoint()
         from_codepoint = next_from_codepoint()
 
@@ -253,8 +343,15 @@ def remap_range(font, from_range: tuple[int, int] | None, to_range: tuple[int, i
     if from_codepoint:
         raise ValueError("Invalid range or remap (remap is smaller than range)")
 
+    pairs = [(from_cp, to_cp) for from_cp, to_cp in pairs
+             if from_cp in present and subset.contains(to_cp)]
+    util.font_transfer(font, font, pairs)
+    for from_codepoint, to_codepoint in pairs:
+        font[to_codepoint].glyphname = font[from_codepoint].glyphname
+        present.add(to_codepoint)
 
-def _remap_util(font, from_range: tuple[int, int], to_range: tuple[int, int]) -> tuple[Callable[[], int | None], Callable[[], int | None]]:
+
+def _remap_util(present: set[int], from_range: tuple[int, int], to_range: tuple[int, int]) -> tuple[Callable[[], int | None], Callable[[], int | None]]:
     fixed_from = _tuple_to_range(from_range or to_range)
     fixed_to = _tuple_to_range(to_range)
     remain_skip_count = len(fixed_from) - len(fixed_to)
@@ -266,13 +363,10 @@ def _remap_util(font, from_range: tuple[int, int], to_range: tuple[int, int]) ->
             nonlocal remain_skip_count, from_iter
             ret = next(from_iter, None)
             while ret and remain_skip_count >= 0:
-                try:
-                    _ = font[ret]
+                if ret in present:
                     break
-                except TypeError:  # No such glyph
-                    remain_skip_count -= 1
-                    ret = next(from_iter, None)
-                    continue
+                remain_skip_count -= 1
+                ret = next(from_iter, None)
             return ret
     elif remain_skip_count == 0:
         def next_from_codepoint():
@@ -288,44 +382,105 @@ def _remap_util(font, from_range: tuple[int, int], to_range: tuple[int, int]) ->
     return next_to_codepoint, next_from_codepoint
 
 
-def transform_all(font, scale: tuple[float, float], translate: tuple[int, int]) -> None:
-    scale = psMat.scale(*scale)
-    translate = psMat.translate(*translate)
-    transform = psMat.compose(scale, translate)
-    font.selection.all()
-    font.transform(transform)
-    for glyph in list(font.selection.byGlyphs):
-        if glyph.width != 0:
-            glyph.left_side_bearing = int(max(glyph.left_side_bearing, 0))
-            glyph.right_side_bearing = int(max(glyph.right_side_bearing, 0))
-        glyph.width = P.EM // 2
-    font.selection.none()
-
+def generate(font, build_file: str) -> None:
+    if not affine.ENABLED:
+        transform(font)
+        util.font_into_file(font, build_file)
+        return
 
-def modify(font, script: str) -> None:
-    for line in script.split(sep="\n"):
+    # The glyphs are generated untransformed and transformed at table level
+    # in one pass (affine.py)
+    matrices = glyph_matrices(font)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_file = join(tmp_dir, basename(build_file))
+        util.font_into_file(font, tmp_file)
+        ttfont = TTFont(tmp_file, recalcBBoxes=False, recalcTimestamp=False)
+        cmap = ttfont.getBestCmap()
+        names = {cmap[codepoint]: matrix for codepoint, matrix in matrices.items() if codepoint in cmap}
+        affine.transform_glyphs(ttfont, names, {name: P.EM // 2 for name in names})
+        ttfont.save(build_file)
+        ttfont.close()
+
+
+def transform(font) -> None:
+    # Transforms the glyphs in fontforge, for the live font of pipeline.py
+    for codepoint, matrix in glyph_matrices(font).items():
+        glyph = font[codepoint]
+        glyph.transform(matrix)
+        glyph.width = P.EM // 2
+    util.fix_all_glyph_points(font, round=True)
+
+
+def glyph_matrices(font) -> dict[int, tuple]:
+    # Codepoint -> matrix of each copied glyph, from the source the glyph was
+    # taken from (later sources win, like in `combine()`)
+    sources: dict[int, int] = {}
+    for i, info in enumerate(SOURCES_INFO):
+        for range_ in info["ranges"]:
+            sources.update(dict.fromkeys(_tuple_to_range(range_), i))
+    modify_indexes = [compile_modify(info) for info in SOURCES_INFO]
+
+    matrices = {}
+    for glyph in font.glyphs():
+        i = sources.get(glyph.encoding)
+        if i is None:
+            continue
+        base = psMat.compose(psMat.scale(*SOURCES_INFO[i]["scale"]), psMat.translate(*SOURCES_INFO[i]["translate"]))
+        matrices[glyph.encoding] = glyph_matrix(glyph, base, modify_indexes[i].get(glyph.encoding))
+    return matrices
+
+
+def glyph_matrix(glyph, base: tuple, modify: tuple | None = None) -> tuple:
+    # `base` (the source scale/translate), a shift that clamps a negative
+    # left side bearing to 0 (and truncates a positive one), then the
+    # glyph's own matrix from the modify script
+    sx, _, _, _, tx, _ = base
+    dx = 0.0
+    # The transform moves the advance width as well
+    if glyph.width * sx + tx != 0 and not (glyph.foreground.isEmpty() and not glyph.references):
+        lsb = glyph.boundingBox()[0] * sx + tx
+        dx = int(max(lsb, 0)) - lsb
+    matrix = psMat.compose(base, psMat.translate(dx, 0))
+    if modify is not None:
+        matrix = psMat.compose(matrix, modify)
+    return matrix
+
+
+def compile_modify(info: SourceInfo) -> dict[int, tuple]:
+    # Compile the modify script of `info` into codepoint -> matrix.
+    # Every line is `CODEPOINT (SX, SY) (TX, TY)` or `[START, END] (SX, SY) (TX, TY)`.
+    index: dict[int, tuple] = {}
+    if "modify" not in info:
+        return index
+    in_ranges = set()
+    for range_ in info["ranges"]:
+        in_ranges.update(_tuple_to_range(range_))
+
+    for line in info["modify"].split(sep="\n"):
         line = line.strip().replace(" ", "").replace("(", ",(")  # )) <- nvim の自動インデントがおかしくなるので
         if len(line) < 1 or line.startswith("#"):
             continue
         try:
-            ops = ast.literal_eval(line)
-        except SyntaxError:
-            util.log("invalid syntax:", line)
-            continue
-        if type(ops[0]) is int:
-            codepoints = range(ops[0], ops[0] + 1)
-        else:
-            codepoints = range(ops[0][0], ops[0][1] + 1)
-        scale = psMat.scale(*ops[1])
-        translate = psMat.translate(*ops[2])
-        transform_mat = psMat.compose(scale, translate)
+            target, scale, translate = ast.literal_eval(line)
+            if type(target) is int:
+                codepoints = range(target, target + 1)
+            else:
+                start, end = target
+                codepoints = range(start, end + 1)
+            transform_mat = psMat.compose(psMat.scale(*scale), psMat.translate(*translate))
+        except (SyntaxError, ValueError, TypeError):
+            raise ValueError("Invalid modify script:", info["path"], line)
+        if not codepoints or any(codepoint not in in_ranges for codepoint in codepoints):
+            raise ValueError("Modify target out of ranges:", info["path"], line)
         for codepoint in codepoints:
-            font[codepoint].transform(transform_mat)
-            font[codepoint].width = P.EM // 2
+            if codepoint in index:
+                index[codepoint] = psMat.compose(index[codepoint], transform_mat)
+            else:
+                index[codepoint] = transform_mat
+    return index
 
 
-def new_font():
-    familyname = splitext(basename(BUILD_FILE))[0]
+def new_font(familyname: str):
     font = fontforge.font()
     font.ascent = P.ASCENT
     font.descent = P.DESCENT
@@ -339,21 +494,13 @@ def new_font():
     return font
 
 
-def copy_range(font, source, range_: tuple[int, int | None]) -> None:
-    range_iter = iter(_tuple_to_range(range_))
-    codepoint = next(range_iter, None)
-    while codepoint:
-        source.selection.select(codepoint)
-        source.copy()
-        font.selection.select(codepoint)
-        font.paste()
-        try:
-            new_glyphname = font[codepoint].glyphname + "#nf"
-            font[codepoint].glyphname = new_glyphname
-        except TypeError as e:
-            if str(e) != "No such glyph":
-                raise
-        codepoint = next(range_iter, None)
+def copy_range(font, source, present: set[int], range_: tuple[int, int | None]) -> list[int]:
+    codepoints = [codepoint for codepoint in _tuple_to_range(range_)
+                  if codepoint in present and subset.contains(codepoint)]
+    util.font_transfer(source, font, [(codepoint, codepoint) for codepoint in codepoints])
+    for codepoint in codepoints:
+        font[codepoint].glyphname = font[codepoint].glyphname + "#nf"
+    return codepoints
 
 
 def _tuple_to_range(tuple_: tuple[int, int | None]) -> range:
@@ -0,0 +1,144 @@
+import hashlib
+import inspect
+import os
+import shutil
+from os.path import join, isdir, getsize, basename
+from types import ModuleType
+from collections.abc import Callable
+
+# Content-addressed cache of stage outputs.
+#
+# A stage key is a digest of everything the stage output depends on: the input
+# fonts, the source of the stage script and its helper modules, the properties
+# constants it reads and the toolchain version.  Outputs are stored under
+# `CACHE_DIR/<key[:2]>/<key>/` and evicted in LRU order (by mtime) once the
+# total size exceeds `CACHE_SIZE_LIMIT`.
+#
+# Environment variables:
+#   AGAVEJP_CACHE=0           disable the cache
+#   AGAVEJP_CACHE_DIR=<dir>   cache directory (default: .stage-cache)
+#   AGAVEJP_CACHE_SIZE=<MiB>  size limit (default: 4096)
+
+ENABLED = os.environ.get("AGAVEJP_CACHE", "1") != "0"
+CACHE_DIR = os.environ.get("AGAVEJP_CACHE_DIR", ".stage-cache")
+CACHE_SIZE_LIMIT = int(os.environ.get("AGAVEJP_CACHE_SIZE", "4096")) * 1024 * 1024
+
+_file_digests: dict[str, str] = {}
+
+
+def file_digest(path: str) -> str:
+    if path not in _file_digests:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        _file_digests[path] = h.hexdigest()
+    return _file_digests[path]
+
+
+def code_digest(module: ModuleType) -> str:
+    # Digest of the functions and classes defined in `module`, ignoring its
+    # data (e.g. a table of per-source settings hashed separately)
+    h = hashlib.sha256()
+    for name, obj in sorted(vars(module).items()):
+        if (inspect.isfunction(obj) or inspect.isclass(obj)) and obj.__module__ == module.__name__:
+            h.update(inspect.getsource(obj).encode("utf-8"))
+    return h.hexdigest()
+
+
+def functions_digest(*functions: Callable) -> str:
+    # Digest of the source of the given functions only, for stages that run
+    # a part of their module
+    h = hashlib.sha256()
+    for function in functions:
+        h.update(inspect.getsource(function).encode("utf-8"))
+    return h.hexdigest()
+
+
+def constants(module: ModuleType, *names: str) -> dict[str, object]:
+    return {name: getattr(module, name) for name in names}
+
+
+def stage_key(stage: str,
+              inputs: list[str],
+              modules: list[ModuleType],
+              consts: dict[str, object] | None = None,
+              toolchain: str = "") -> str:
+    h = hashlib.sha256()
+
+    def update(*items: object) -> None:
+        for item in items:
+            h.update(str(item).encode("utf-8"))
+            h.update(b"\0")
+
+    update("stage", stage)
+    for path in inputs:
+        update("input", file_digest(path))
+    for module in modules:
+        # Use the file name, not `__name__`, which is "__main__" for the stage script
+        update("module", basename(module.__file__ or ""), file_digest(module.__file__ or ""))
+    for name, value in sorted((consts or {}).items()):
+        update("const", name, repr(value))
+    update("toolchain", toolchain)
+    return h.hexdigest()
+
+
+def _entry_path(key: str) -> str:
+    return join(CACHE_DIR, key[:2], key)
+
+
+def restore(key: str, outputs: list[str]) -> bool:
+    if not ENABLED:
+        return False
+    entry = _entry_path(key)
+    if not isdir(entry):
+        return False
+    for i, output in enumerate(outputs):
+        tmp = f"{output}.tmp{os.getpid()}"
+        shutil.copyfile(join(entry, str(i)), tmp)
+        os.replace(tmp, output)
+    # Mark as recently used
+    os.utime(entry)
+    return True
+
+
+def store(key: str, outputs: list[str]) -> None:
+    if not ENABLED:
+        return
+    entry = _entry_path(key)
+    if isdir(entry):
+        os.utime(entry)
+        return
+
+    tmp = f"{entry}.tmp{os.getpid()}"
+    os.makedirs(tmp, exist_ok=True)
+    for i, output in enumerate(outputs):
+        shutil.copyfile(output, join(tmp, str(i)))
+    try:
+        os.replace(tmp, entry)
+    except OSError:  # Stored by another process in the meantime
+        shutil.rmtree(tmp, ignore_errors=True)
+    evict()
+
+
+def evict(size_limit: int = CACHE_SIZE_LIMIT) -> None:
+    entries = []
+    total = 0
+    for prefix in os.listdir(CACHE_DIR):
+        prefix_dir = join(CACHE_DIR, prefix)
+        if not isdir(prefix_dir):
+            continue
+        for name in os.listdir(prefix_dir):
+            entry = join(prefix_dir, name)
+            if ".tmp" in name or not isdir(entry):
+                continue
+            size = sum(getsize(join(entry, f)) for f in os.listdir(entry))
+            entries.append((os.stat(entry).st_mtime, size, entry))
+            total += size
+
+    entries.sort()
+    for _, size, entry in entries:
+        if total <= size_limit:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
@@ -0,0 +1,122 @@
+# pyright: reportMissingImports=false
+
+import os
+import multiprocessing
+import util
+import hint_cache
+
+# Parallel autoHint/autoInstr.
+#
+# The glyphs are split into codepoint shards which are hinted by forked
+# workers (each inherits the merged font copy-on-write), and the resulting
+# hints and glyph programs are written back into the font.  The font-level
+# tables are set up once before forking; if a worker ends up with different
+# tables the result is discarded and the font is hinted serially, so the
+# output is always identical to the serial path.
+#
+# Glyphs whose outline and hinting settings are unchanged since an earlier
+# build are restored from the hint cache (see hint_cache.py) and only the
+# others are hinted.
+#
+# The number of workers is taken from HINT_WORKERS (default: CPU count).
+
+HINT_WORKERS = int(os.environ.get("HINT_WORKERS", "0")) or os.cpu_count() or 1
+SHARDS_PER_WORKER = 4
+
+# Font shared with the forked workers
+_font = None
+
+
+def hint_all(font, workers: int = HINT_WORKERS) -> None:
+    names = [glyph.glyphname for glyph in font.glyphs("encoding")]
+    if not names:
+        return
+
+    # Let fontforge create cvt/fpgm/prep before forking and before the
+    # cached hints are looked up with them
+    _hint_glyphs(font, names[:1])
+    tables = _hinting_tables(font)
+    keys = hint_cache.glyph_keys(font, names, hint_cache.settings_digest(font, tables))
+    cached = hint_cache.load(keys)
+    apply_hints(font, cached)
+    missing = [name for name in names if name not in cached]
+    util.log("Hint cache:", len(cached), "of", len(names), "glyphs restored")
+    if not missing:
+        return
+
+    glyph_hints = hint_glyphs(font, missing, tables, workers)
+    if glyph_hints is None:
+        util.log("Hinting tables differ between shards, falling back to serial hinting")
+        hint_serial(font)
+        return
+    apply_hints(font, glyph_hints)
+    hint_cache.store(keys, glyph_hints)
+
+
+def hint_glyphs(font, names: list[str], tables: tuple, workers: int) -> dict[str, tuple] | None:
+    # Hints of `names`, or None if hinting them changed the font tables
+    if workers <= 1 or len(names) < workers * SHARDS_PER_WORKER:
+        _hint_glyphs(font, names)
+        if _hinting_tables(font) != tables:
+            return None
+        return {name: _glyph_hints(font[name]) for name in names}
+
+    shard_count = workers * SHARDS_PER_WORKER
+    shard_size = -(-len(names) // shard_count)
+    shards = [names[i:i + shard_size] for i in range(0, len(names), shard_size)]
+
+    global _font
+    _font = font
+    try:
+        with multiprocessing.get_context("fork").Pool(workers) as pool:
+            results = pool.map(_hint_shard, shards)
+    finally:
+        _font = None
+
+    if any(shard_tables != tables for shard_tables, _ in results):
+        return None
+    return {name: hints for _, shard_hints in results for name, hints in shard_hints.items()}
+
+
+def hint_serial(font) -> None:
+    font.selection.all()
+    font.autoHint()
+    font.autoInstr()
+    font.selection.none()
+
+
+def apply_hints(font, glyph_hints: dict[str, tuple]) -> None:
+    for name, (hhints, vhints, ttinstrs) in glyph_hints.items():
+        glyph = font[name]
+        glyph.hhints = hhints
+        glyph.vhints = vhints
+        # Set the program last, changing hints may invalidate it
+        glyph.ttinstrs = ttinstrs
+
+
+def _hint_shard(names: list[str]) -> tuple[tuple, dict[str, tuple]]:
+    font = _font
+    _hint_glyphs(font, names)
+    return _hinting_tables(font), {name: _glyph_hints(font[name]) for name in names}
+
+
+def _glyph_hints(glyph) -> tuple:
+    return (glyph.hhints, glyph.vhints, bytes(glyph.ttinstrs))
+
+
+def _hint_glyphs(font, names: list[str]) -> None:
+    font.selection.none()
+    for name in names:
+        font.selection.select(("more",), name)
+    font.autoHint()
+    font.autoInstr()
+    font.selection.none()
+
+
+def _hinting_tables(font) -> tuple:
+    return (
+        tuple(font.cvt),
+        font.getTableData("fpgm"),
+        font.getTableData("prep"),
+        tuple((key, font.private[key]) for key in font.private),
+    )
@@ -0,0 +1,104 @@
+# pyright: reportMissingImports=false
+
+import os
+import json
+import time
+import hashlib
+import sqlite3
+from os.path import join
+import fontforge
+import cache
+
+# Persistent per-glyph cache of autoHint/autoInstr results.
+#
+# A glyph is keyed by a digest of its outline (points and references) and of
+# the hinting settings of the font: em, the cvt/fpgm/prep tables and the
+# private dictionary (blue zones, stem widths), plus the fontforge version.
+# The hints and glyph programs are kept in an SQLite database in the stage
+# cache directory, so a merge whose glyphs are mostly unchanged only hints
+# the changed ones.  Disabled with the stage cache (AGAVEJP_CACHE=0).
+
+DB_FILE = join(cache.CACHE_DIR, "hints.sqlite3")
+# Least recently used entries beyond this are removed
+MAX_ENTRIES = 400000
+
+
+def settings_digest(font, tables: tuple) -> str:
+    h = hashlib.sha256()
+    h.update(repr((font.em, tables, fontforge.version())).encode("utf-8"))
+    return h.hexdigest()
+
+
+def glyph_keys(font, names: list[str], settings: str) -> dict[str, str]:
+    outlines: dict[str, str] = {}
+
+    def outline(name: str) -> str:
+        # Digest of the outline, including the outlines of referenced glyphs
+        if name not in outlines:
+            glyph = font[name]
+            h = hashlib.sha256()
+            for contour in glyph.foreground:
+                h.update(repr((contour.closed, contour.is_quadratic,
+                               [(p.x, p.y, p.on_curve) for p in contour])).encode("utf-8"))
+            for ref_name, matrix, *_ in glyph.references:
+                h.update(repr((ref_name, matrix, outline(ref_name))).encode("utf-8"))
+            outlines[name] = h.hexdigest()
+        return outlines[name]
+
+    return {name: hashlib.sha256(f"{settings}:{outline(name)}".encode("utf-8")).hexdigest() for name in names}
+
+
+def _connect() -> sqlite3.Connection:
+    # Several merges may use the database at once
+    os.makedirs(cache.CACHE_DIR, exist_ok=True)
+    db = sqlite3.connect(DB_FILE, timeout=60)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("CREATE TABLE IF NOT EXISTS hints "
+               "(key TEXT PRIMARY KEY, hhints TEXT, vhints TEXT, ttinstrs BLOB, used REAL)")
+    return db
+
+
+def load(keys: dict[str, str]) -> dict[str, tuple]:
+    # Glyph name -> (hhints, vhints, ttinstrs) of the cached glyphs
+    if not cache.ENABLED or not keys:
+        return {}
+    names_by_key: dict[str, list[str]] = {}
+    for name, key in keys.items():
+        names_by_key.setdefault(key, []).append(name)
+
+    glyph_hints = {}
+    db = _connect()
+    try:
+        with db:
+            db.execute("CREATE TEMP TABLE wanted (key TEXT PRIMARY KEY)")
+            db.executemany("INSERT OR IGNORE INTO wanted VALUES (?)", ((key,) for key in names_by_key))
+            rows = db.execute("SELECT hints.key, hhints, vhints, ttinstrs FROM hints "
+                              "JOIN wanted ON hints.key = wanted.key").fetchall()
+            db.execute("UPDATE hints SET used = ? WHERE key IN (SELECT key FROM wanted)", (time.time(),))
+    finally:
+        db.close()
+    for key, hhints, vhints, ttinstrs in rows:
+        hints = (_tuples(json.loads(hhints)), _tuples(json.loads(vhints)), bytes(ttinstrs))
+        for name in names_by_key[key]:
+            glyph_hints[name] = hints
+    return glyph_hints
+
+
+def store(keys: dict[str, str], glyph_hints: dict[str, tuple]) -> None:
+    if not cache.ENABLED or not glyph_hints:
+        return
+    now = time.time()
+    rows = [(keys[name], json.dumps(hhints), json.dumps(vhints), ttinstrs, now)
+            for name, (hhints, vhints, ttinstrs) in glyph_hints.items()]
+    db = _connect()
+    try:
+        with db:
+            db.executemany("INSERT OR REPLACE INTO hints VALUES (?, ?, ?, ?, ?)", rows)
+            db.execute("DELETE FROM hints WHERE key IN "
+                       "(SELECT key FROM hints ORDER BY used DESC LIMIT -1 OFFSET ?)", (MAX_ENTRIES,))
+    finally:
+        db.close()
+
+
+def _tuples(hints: list) -> tuple:
+    return tuple(tuple(hint) for hint in hints)
@@ -2,58 +2,175 @@
 
 import sys
 from typing import Literal, TypeGuard
+from collections.abc import Callable
 import fontforge
 import psMat
 import util
+import cache
+import hint
+import hint_cache
+import telemetry
 import properties as P
-from datetime import datetime
+import reproducible
 
-if len(sys.argv) != 5:
-    raise ValueError("Invalid argument")
+FontStyle = Literal["Regular", "Bold", "Italic", "BoldItalic"]
+
+# Upright style -> oblique style derived from the same merged font
+ITALIC_STYLES: dict[FontStyle, FontStyle] = {
+    "Regular": "Italic",
+    "Bold": "BoldItalic",
+}
+
+HINTING_TABLES = ("cvt ", "fpgm", "prep")
 
-def is_font_style(style: str) -> TypeGuard[Literal["Regular", "Bold", "Italic", "BoldItalic"]]:
-    return style in ["Regular", "Bold", "Italic", "BoldItalic"]
 
-FONT_EN_TTF = sys.argv[1]
-FONT_JP_TTF = sys.argv[2]
-if not is_font_style(sys.argv[3]):
-    raise ValueError("Invalid font style")
-else:
-    FONT_STYLE = sys.argv[3]
-BUILD_FILE = sys.argv[4]
+def is_font_style(style: str) -> TypeGuard[FontStyle]:
+    return style in ["Regular", "Bold", "Italic", "BoldItalic"]
 
 
 def main() -> None:
+    # merge.py EN_TTF JP_TTF STYLE BUILD_FILE [ITALIC_BUILD_FILE]
+    # With ITALIC_BUILD_FILE, the oblique sibling of the upright STYLE is
+    # derived from the same merged font.
+    if len(sys.argv) not in (5, 6):
+        raise ValueError("Invalid argument")
+    font_en_ttf = sys.argv[1]
+    font_jp_ttf = sys.argv[2]
+    if not is_font_style(sys.argv[3]):
+        raise ValueError("Invalid font style")
+    font_style = sys.argv[3]
+    build_files = sys.argv[4:]
+
+    styles: list[FontStyle] = [font_style]
+    if len(build_files) == 2:
+        if font_style not in ITALIC_STYLES:
+            raise ValueError("Italic output requires an upright style:", font_style)
+        styles.append(ITALIC_STYLES[font_style])
+
+    key = cache.stage_key(
+        "merge:" + ",".join(styles),
+        [font_en_ttf, font_jp_ttf],
+        [sys.modules[__name__], util, hint, hint_cache, reproducible],
+        {
+            "source_date": reproducible.source_date().strftime("%F"),
+            **cache.constants(P, "FAMILY", "VERSION", "ENCODING", "COPYRIGHT",
+                              "ASCENT", "DESCENT", "ITALICANGLE",
+                              "UNDERLINE_POS", "UNDERLINE_HEIGHT", "STYLE_PROPERTY"),
+        },
+        fontforge.version(),
+    )
+    inputs = [font_en_ttf, font_jp_ttf]
+    with telemetry.stage("merge", ",".join(styles), inputs, build_files) as record:
+        if cache.restore(key, build_files):
+            record.cached = True
+            util.log("Restored:", *build_files)
+            return
+
+        with record.phase("open"):
+            en_font = fontforge.open(font_en_ttf)
+            jp_font = fontforge.open(font_jp_ttf)
+        record.glyphs_in = util.font_glyph_count(en_font) + util.font_glyph_count(jp_font)
+        with record.phase("transform"):
+            font = merge_base(en_font, jp_font)
+        en_font.close()
+        jp_font.close()
+
+        def generate(font, style: FontStyle) -> None:
+            build_file = build_files[styles.index(style)]
+            with record.phase("generate"):
+                util.font_into_file(font, build_file, close=False)
+            util.log("Generated:", build_file)
+
+        derive_styles(font, styles, generate)
+        record.glyphs_out = util.font_glyph_count(font)
+        font.close()
+        cache.store(key, build_files)
+
+
+def merge(en_font, jp_font, style: FontStyle):
+    font = merge_base(en_font, jp_font)
+    finalize(font, style)
+    return font
+
+
+def merge_base(en_font, jp_font):
+    # Unhinted upright font shared by every style of the same weight
     font = new_font()
+    merge_en(font, en_font)
+    merge_jp(font, jp_font)
+    return font
 
-    merge_en(font)
-    merge_jp(font)
 
-    if "Italic" in FONT_STYLE:
-        make_italic(font)
-        util.fix_all_glyph_points(font, round=True, addExtrema=True)
-    else:
-        util.fix_all_glyph_points(font, addExtrema=True)
+def finalize(font, style: FontStyle) -> None:
+    set_style_property(font, style)
+
+    with telemetry.phase("transform"):
+        if "Italic" in style:
+            make_italic(font)
+            util.fix_all_glyph_points(font, round=True, addExtrema=True)
+        else:
+            util.fix_all_glyph_points(font, addExtrema=True)
+
+    with telemetry.phase("hint"):
+        hint.hint_all(font)
+
+
+def derive_styles(font, styles: list[FontStyle], on_style: Callable[..., None]) -> None:
+    # Finalize `font` into each style in turn.  `on_style(font, style)` is
+    # called with the finalized font, which is then reset to the merged state
+    # for the next style.
+    snapshot = snapshot_font(font)
+    for i, style in enumerate(styles):
+        if i > 0:
+            restore_font(font, snapshot)
+        finalize(font, style)
+        on_style(font, style)
 
-    font.selection.all()
-    font.autoHint()
-    font.autoInstr()
-    font.selection.none()
 
-    util.font_into_file(font, BUILD_FILE)
-    util.log("Generated:", BUILD_FILE)
+def snapshot_font(font) -> dict:
+    # Everything `finalize()` changes apart from the style metadata
+    glyphs = {}
+    for glyph in font.glyphs():
+        glyphs[glyph.glyphname] = (glyph.foreground, glyph.references, glyph.anchorPoints)
+    return {
+        "glyphs": glyphs,
+        "tables": {tag: font.getTableData(tag) for tag in HINTING_TABLES},
+        "private": {key: font.private[key] for key in font.private},
+    }
 
 
-def merge_en(font) -> None:
-    en_font = fontforge.open(FONT_EN_TTF)
+def restore_font(font, snapshot: dict) -> None:
+    glyphs = snapshot["glyphs"]
+    for glyph in list(font.glyphs()):
+        if glyph.glyphname not in glyphs:
+            # Added after the snapshot (e.g. patch glyphs)
+            font.removeGlyph(glyph)
+            continue
+        foreground, references, anchor_points = glyphs[glyph.glyphname]
+        glyph.foreground = foreground
+        glyph.references = references
+        glyph.anchorPoints = anchor_points
+        glyph.hhints = ()
+        glyph.vhints = ()
+        glyph.ttinstrs = b""
+
+    for tag, data in snapshot["tables"].items():
+        font.setTableData(tag, data)
+
+    private = snapshot["private"]
+    for key in [key for key in font.private if key not in private]:
+        del font.private[key]
+    for key, value in private.items():
+        font.private[key] = value
+
+
+def merge_en(font, en_font) -> None:
     en_font.encoding = P.ENCODING
     font.mergeFonts(en_font)
-    en_font.close()
-    util.log("Merged:", FONT_EN_TTF, "->", BUILD_FILE)
+    util.log("Merged:", en_font.fontname, "->", P.FAMILY)
 
 
-def merge_jp(font) -> None:
-    jp_font = fontforge.open(FONT_JP_TTF)
+def merge_jp(font, jp_font) -> None:
     font.mergeFonts(jp_font)
     for glyph in jp_font.glyphs():
         unicode = glyph.unicode
@@ -62,8 +179,7 @@ def merge_jp(font) -> None:
         if glyph.altuni is not None:
             font[unicode].altuni = glyph.altuni
         font[unicode].unicode = unicode
-    jp_font.close()
-    util.log("Merged:", FONT_JP_TTF, "->", BUILD_FILE)
+    util.log("Merged:", jp_font.fontname, "->", P.FAMILY)
 
 
 def make_italic(font) -> None:
@@ -96,36 +212,15 @@ def make_italic(font) -> None:
 
 
 def new_font():
-    style_prop = P.STYLE_PROPERTY[FONT_STYLE]
     font = fontforge.font()
     font.ascent = P.ASCENT
     font.descent = P.DESCENT
-    font.italicangle = P.ITALICANGLE if "Italic" in FONT_STYLE else 0
     font.upos = P.UNDERLINE_POS
     font.uwidth = P.UNDERLINE_HEIGHT
     font.familyname = P.FAMILY
     font.copyright = P.COPYRIGHT
     font.encoding = P.ENCODING
-    font.fontname = P.FAMILY + "-" + FONT_STYLE
-    font.fullname = P.FAMILY + " " + FONT_STYLE
     font.version = P.VERSION
-    font.appendSFNTName(
-        "English (US)",
-        "SubFamily",
-        "".join([" " + c if c.isupper() else c for c in FONT_STYLE]).lstrip()
-    )
-    font.appendSFNTName(
-        "English (US)",
-        "UniqueID",
-        "; ".join(
-            [
-                f"FontForge {fontforge.version()}",
-                P.FAMILY + " " + FONT_STYLE,
-                P.VERSION,
-                datetime.today().strftime("%F"),
-            ]
-        ),
-    )
 
     font.gasp_version = 1
     font.gasp = (
@@ -133,23 +228,8 @@ def new_font():
          ('gridfit', 'antialias', 'symmetric-smoothing', 'gridfit+smoothing')),
     )
 
-    font.weight = style_prop["weight"]
-    font.os2_weight = style_prop["os2_weight"]
     font.os2_width = 5  # Medium (100%)
-    font.os2_stylemap = style_prop["os2_stylemap"]
     font.os2_vendor = "2357"  # Me
-    font.os2_panose = (  # https://monotype.github.io/panose/pan1.htm
-        2,                            # Family Kind = 2-Latin: Text and Display
-        11,                           # Serif Style = Nomal Sans
-        style_prop["panose_weight"],  # Weight
-        9,                            # Proportion = 9-Monospaced
-        3,                            # Contrast = 3-Very Low
-        2,                            # Stroke Variation = 2-No Variation
-        2,                            # Arm Style = 2-Straight Arms/Horizontal
-        style_prop['panose_letterform'],  # Letterform
-        2,                            # Midline = 2-Standard/Trimmed
-        4,                            # X-height = 4-Constant/Large
-    )
 
     # typoascent, typodescent is generic version for above.
     # the `_add` version is for setting offsets.
@@ -177,5 +257,45 @@ def new_font():
     return font
 
 
+def set_style_property(font, style: FontStyle) -> None:
+    style_prop = P.STYLE_PROPERTY[style]
+    font.italicangle = P.ITALICANGLE if "Italic" in style else 0
+    font.fontname = P.FAMILY + "-" + style
+    font.fullname = P.FAMILY + " " + style
+    font.appendSFNTName(
+        "English (US)",
+        "SubFamily",
+        "".join([" " + c if c.isupper() else c for c in style]).lstrip()
+    )
+    font.appendSFNTName(
+        "English (US)",
+        "UniqueID",
+        "; ".join(
+            [
+                f"FontForge {fontforge.version()}",
+                P.FAMILY + " " + style,
+                P.VERSION,
+                reproducible.source_date().strftime("%F"),
+            ]
+        ),
+    )
+
+    font.weight = style_prop["weight"]
+    font.os2_weight = style_prop["os2_weight"]
+    font.os2_stylemap = style_prop["os2_stylemap"]
+    font.os2_panose = (  # https://monotype.github.io/panose/pan1.htm
+        2,                            # Family Kind = 2-Latin: Text and Display
+        11,                           # Serif Style = Nomal Sans
+        style_prop["panose_weight"],  # Weight
+        9,                            # Proportion = 9-Monospaced
+        3,                            # Contrast = 3-Very Low
+        2,                            # Stroke Variation = 2-No Variation
+        2,                            # Arm Style = 2-Straight Arms/Horizontal
+        style_prop['panose_letterform'],  # Letterform
+        2,                            # Midline = 2-Standard/Trimmed
+        4,                            # X-height = 4-Constant/Large
+    )
+
+
 if __name__ == "__main__":
     main()
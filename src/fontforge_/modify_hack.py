@@ -4,27 +4,58 @@ import sys
 import fontforge
 import psMat
 import util
+import transform_plan
+import cache
+import subset
+import ownership
+import telemetry
 import properties as const
 
-if len(sys.argv) != 3:
-    raise ValueError("Invalid argument")
-
-FONT_FILE = sys.argv[1]
-BUILD_FILE = sys.argv[2]
-
 
 def main() -> None:
-    font = fontforge.open(FONT_FILE)
-
-    # Use IBMPlexSansJP glyph
-    util.font_clear_glyph(font, 0x2003)  # 　(EM SPACE)
-    util.font_clear_glyph(font, 0x266a)  # ♪
-
-    # Use Nerd Font glyph
-    util.font_clear_glyph(font, 0xe0a0, 0xe0b3)  # Private Use Area
+    if len(sys.argv) != 3:
+        raise ValueError("Invalid argument")
+    font_file = sys.argv[1]
+    build_file = sys.argv[2]
+
+    key = cache.stage_key(
+        "modify_hack",
+        [font_file],
+        [sys.modules[__name__], util, subset, transform_plan, ownership],
+        {**cache.constants(const, "ASCENT", "DESCENT", "EM"), "subset": subset.digest(),
+         "ownership": ownership.foreign_ranges("hack")},
+        fontforge.version(),
+    )
+    with telemetry.stage("modify_hack", None, [font_file], [build_file]) as record:
+        if cache.restore(key, [build_file]):
+            record.cached = True
+            util.log("Restored:", build_file)
+            return
+
+        with record.phase("open"):
+            font = fontforge.open(font_file)
+        record.glyphs_in = util.font_glyph_count(font)
+        with record.phase("transform"):
+            modify(font)
+        record.glyphs_out = util.font_glyph_count(font)
+        with record.phase("generate"):
+            util.font_into_file(font, build_file)
+        cache.store(key, [build_file])
+    util.log("Modified:", font_file, "->", build_file)
+
+
+def modify(font) -> None:
+    subset.font_apply(font)
+
+    # Use IBMPlexSansJP and Nerd Font glyphs (see ownership.json)
+    util.font_clear_ranges(font, ownership.foreign_ranges("hack"))
 
     util.font_set_em(font, const.ASCENT, const.DESCENT, const.EM)
-    util.font_resize_all_width(font, const.EM // 2)
+
+    # Width fix and rounding in a single pass
+    plan = transform_plan.TransformPlan(font)
+    plan.resize_all_width(const.EM // 2)
+    plan.apply(round=True)
 
     # TODO: Create glyph
     # 0x226a: ≪
@@ -32,13 +63,10 @@ def main() -> None:
     #fix_subscript_numbers(font)
     #create_up_tack(font)
 
+    # NOTE: Glyphs edited here need `util.fix_all_glyph_points(font, round=True)`
     #modify_0(font)
     #modify_m(font)
 
-    util.fix_all_glyph_points(font, round=True)
-    util.font_into_file(font, BUILD_FILE)
-    util.log("Modified:", FONT_FILE, "->", BUILD_FILE)
-
 
 def fix_subscript_numbers(font) -> None:
     def cp(from_: int | str, to: int | str):
@@ -4,17 +4,63 @@ import sys
 import fontforge
 import psMat
 import util
+import transform_plan
+import affine
+import cache
+import subset
+import ownership
+import telemetry
 import properties as const
 
-if len(sys.argv) != 3:
-    raise ValueError("Invalid argument")
-
-FONT_FILE = sys.argv[1]
-BUILD_FILE = sys.argv[2]
+# Glyphs modify() and merge.make_italic() work on, kept in subset builds
+SUBSET_CODEPOINTS = (0x2103, 0x2109, 0x2121, 0x212b, 0xfb01, 0xfb02, 0x3000)
+SUBSET_GLYPHS = (
+    "section", "dagger.prop", "daggerdbl.prop", "paragraph", "perthousand.full",
+    "degree", "plusminus", "multiply", "divide", "zero.zero", "uni51F0",
+    "a.alt01", "g.alt01", "g.alt02", "zero.alt01", "minus",
+    "uni301F.half", "acute.half",
+)
 
 
 def main() -> None:
-    font = fontforge.open(FONT_FILE)
+    if len(sys.argv) != 3:
+        raise ValueError("Invalid argument")
+    font_file = sys.argv[1]
+    build_file = sys.argv[2]
+
+    key = cache.stage_key(
+        "modify_ibm_plex_sans_jp",
+        [font_file],
+        [sys.modules[__name__], util, subset, transform_plan, ownership, affine],
+        {**cache.constants(const, "ASCENT", "DESCENT", "EM"), "subset": subset.digest(),
+         "ownership": ownership.foreign_ranges("ibm"), "affine": affine.ENABLED},
+        fontforge.version(),
+    )
+    with telemetry.stage("modify_ibm_plex_sans_jp", None, [font_file], [build_file]) as record:
+        if cache.restore(key, [build_file]):
+            record.cached = True
+            util.log("Restored:", build_file)
+            return
+
+        with record.phase("open"):
+            font = fontforge.open(font_file)
+        record.glyphs_in = util.font_glyph_count(font)
+        with record.phase("transform"):
+            plan = modify(font, apply=not affine.ENABLED)
+        record.glyphs_out = util.font_glyph_count(font)
+        with record.phase("generate"):
+            if affine.ENABLED:
+                # The width fixes and the global scale are applied at table level
+                plan.generate(build_file)
+                font.close()
+            else:
+                util.font_into_file(font, build_file)
+        cache.store(key, [build_file])
+    util.log("Modified:", font_file, "->", build_file)
+
+
+def modify(font, apply: bool = True) -> transform_plan.TransformPlan:
+    subset.font_apply(font, SUBSET_CODEPOINTS, SUBSET_GLYPHS)
 
     # Remove kerning info
     for lookup in font.gpos_lookups:
@@ -27,8 +73,11 @@ def main() -> None:
             font.removeLookup(lookup)
 
     # Remove vertical fonts
-    font.removeLookup("'vert' Vertical Alternates lookup 18")
-    font.removeLookup("'vrt2' Vertical Rotation & Alternates lookup 19")
+    # (matched by feature tag, the lookup numbers differ in subset fonts)
+    for lookup in font.gsub_lookups:
+        if lookup.startswith("'vert'") or \
+           lookup.startswith("'vrt2'"):
+            font.removeLookup(lookup)
     for glyph in font.glyphs():
         if glyph.unicode != -1:
             continue
@@ -36,27 +85,21 @@ def main() -> None:
         if name.endswith(".rotat"):
             util.font_clear_glyph(font, name)
 
-    # Use Hack glyph
-    util.font_clear_glyph(font, 0x20, 0x2002)    # number, alphabet, etc
-    util.font_clear_glyph(font, 0x2004, 0x2044)  # ← skipping 0x2003 (EM SPACE)
-    util.font_clear_glyph(font, 0x20ac)          # €
-    util.font_clear_glyph(font, 0x2190, 0x21f5)  # arrow
-    util.font_clear_glyph(font, 0x2200, 0x22A5)  # math symbol
-    util.font_clear_glyph(font, 0x2116)          # №
-    util.font_clear_glyph(font, 0x2122)          # ™
-    util.font_clear_glyph(font, 0x23a7, 0x23ad)  # curly bracket
-    util.font_clear_glyph(font, 0x2500, 0x2595)  # border symbol
-    util.font_clear_glyph(font, 0x25a0, 0x25ef)  # block symbol
+    # Use Hack and Nerd Font glyphs (see ownership.json)
+    util.font_clear_ranges(font, ownership.foreign_ranges("ibm"))
 
     util.font_set_em(font, const.ASCENT, const.DESCENT, const.EM)
 
+    # Width fixes and the global scale are applied in one pass at the end
+    plan = transform_plan.TransformPlan(font)
+
     # Shrink to 1:2
-    util.glyph_riseze_width(font[0x2103], const.EM // 2)  # ℃
-    util.glyph_riseze_width(font[0x2109], const.EM // 2)  # ℉
-    util.glyph_riseze_width(font[0x2121], const.EM // 2)  # ℡
-    util.glyph_riseze_width(font[0x212B], const.EM // 2)  # Å
-    util.glyph_riseze_width(font[0xfb01], const.EM // 2)  # ﬁ
-    util.glyph_riseze_width(font[0xfb02], const.EM // 2)  # ﬂ
+    plan.resize_width(font[0x2103], const.EM // 2)  # ℃
+    plan.resize_width(font[0x2109], const.EM // 2)  # ℉
+    plan.resize_width(font[0x2121], const.EM // 2)  # ℡
+    plan.resize_width(font[0x212B], const.EM // 2)  # Å
+    plan.resize_width(font[0xfb01], const.EM // 2)  # ﬁ
+    plan.resize_width(font[0xfb02], const.EM // 2)  # ﬂ
 
     # Fix width (Note that I don't know the meaning of the following glyphs)
     # unkown scale: 1257 name: section
@@ -79,19 +122,20 @@ def main() -> None:
                  "degree", "plusminus", "multiply",
                  "divide", "zero.zero", "uni51F0", "a.alt01", "g.alt01",
                  "g.alt02", "zero.alt01", "minus"):
-        util.glyph_riseze_width(font[name], const.EM // 2)
+        plan.resize_width(font[name], const.EM // 2)
     for name in ("perthousand.full", "uni51F0"):
-        util.glyph_riseze_width(font[name], const.EM)
+        plan.resize_width(font[name], const.EM)
 
+    # 0x3000 has no width fix pending, so it can be drawn on directly
     modify_whitespace(font)
-    resize_all_scale(font)
+    resize_all_scale(plan)
 
-    util.fix_all_glyph_points(font, round=True)
-    util.font_into_file(font, BUILD_FILE)
-    util.log("Modified:", FONT_FILE, "->", BUILD_FILE)
+    if apply:
+        plan.apply(round=True)
+    return plan
 
 
-def resize_all_scale(font) -> None:
+def resize_all_scale(plan: transform_plan.TransformPlan) -> None:
     scale = 0.82
     x_to_center = const.EM * (1 - scale) / 2
 
@@ -99,14 +143,12 @@ def resize_all_scale(font) -> None:
     trans_mat = [psMat.translate(x) for x in (x_to_center, x_to_center / 2)]
     mat = [psMat.compose(scale_mat[i], trans_mat[i]) for i in range(2)]
 
-    for glyph in font.glyphs():
-        width = glyph.width
+    for glyph in plan.font.glyphs():
+        width = plan.width(glyph)
         if width == const.EM:
-            glyph.transform(mat[0])
-            glyph.width = const.EM
+            plan.transform(glyph, mat[0], const.EM)
         elif width == const.EM // 2:
-            glyph.transform(mat[1])
-            glyph.width = const.EM // 2
+            plan.transform(glyph, mat[1], const.EM // 2)
         else:
             name = glyph.glyphname
             util.log(f"unkown scale: {width} name: {name}")
@@ -0,0 +1,170 @@
+import sys
+import json
+from os.path import join, dirname
+from typing import Final
+import sfnt
+
+# Which source font provides the glyph of each codepoint.
+#
+# By default the first source of PRECEDENCE that has a glyph wins: merge.py
+# takes Hack and fills in IBM Plex Sans JP, and the fonttools stage patches
+# the Nerd Fonts and Braille glyphs only where the merged font has none.
+# `ownership.json` assigns ranges to a source explicitly; the modify stages
+# clear the glyphs of their source that are assigned to another one
+# (`foreign_ranges()`) in a single batched clear.
+#
+# Only the standard library is used, so this also works in the fonttools
+# image.
+#
+# ownership.py MAP_FILE SOURCE=FONT [SOURCE=FONT ...]
+#   Writes the ownership map of the source fonts as intervals to MAP_FILE and
+#   reports
+#     - conflicts: codepoints several sources have a glyph for that are
+#       decided by precedence only
+#     - gaps: assigned codepoints their owner has no glyph for while another
+#       source has one, and glyphs shared by codepoints of different owners
+#       (clearing one of the codepoints clears them all)
+#     - unused assignments: codepoints no source has a glyph for
+
+OVERRIDES_FILE: Final = join(dirname(__file__), "ownership.json")
+
+Interval = tuple[int, int, str]
+
+
+def parse_range(spec: str) -> tuple[int, int]:
+    start, _, end = spec.upper().removeprefix("U+").partition("-")
+    return int(start, 16), int(end or start, 16)
+
+
+def load(path: str = OVERRIDES_FILE) -> tuple[list[str], list[Interval]]:
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    precedence = data["precedence"]
+    overrides = []
+    for override in data["overrides"]:
+        if override["owner"] not in precedence:
+            raise ValueError("Unknown owner:", override["owner"])
+        for spec in override["ranges"]:
+            start, end = parse_range(spec)
+            overrides.append((start, end, override["owner"]))
+    overrides.sort()
+    for (_, end, owner), (start, _, next_owner) in zip(overrides, overrides[1:]):
+        if start <= end:
+            raise ValueError(f"Overlapping assignments: U+{start:04X} ({owner}, {next_owner})")
+    return precedence, overrides
+
+
+PRECEDENCE, OVERRIDES = load()
+
+
+def foreign_ranges(source: str) -> list[tuple[int, int]]:
+    # Ranges assigned to other sources, merged
+    ranges: list[list[int]] = []
+    for start, end, owner in OVERRIDES:
+        if owner == source:
+            continue
+        if ranges and ranges[-1][1] + 1 >= start:
+            ranges[-1][1] = max(ranges[-1][1], end)
+        else:
+            ranges.append([start, end])
+    return [(start, end) for start, end in ranges]
+
+
+def assigned_owner(codepoint: int) -> str | None:
+    for start, end, owner in OVERRIDES:
+        if start <= codepoint <= end:
+            return owner
+        if start > codepoint:
+            break
+    return None
+
+
+def ownership_map(cmaps: dict[str, dict[int, int]]) -> list[Interval]:
+    # Owner of every codepoint some source has, as intervals
+    sources = [source for source in PRECEDENCE if source in cmaps]
+    owners = {}
+    for codepoint in sorted(set().union(*cmaps.values())):
+        owner = assigned_owner(codepoint)
+        if owner is None:
+            owner = next(source for source in sources if codepoint in cmaps[source])
+        owners[codepoint] = owner
+    return to_intervals(owners)
+
+
+def to_intervals(owners: dict[int, str]) -> list[Interval]:
+    intervals: list[list] = []
+    for codepoint, owner in sorted(owners.items()):
+        if intervals and intervals[-1][1] == codepoint - 1 and intervals[-1][2] == owner:
+            intervals[-1][1] = codepoint
+        else:
+            intervals.append([codepoint, codepoint, owner])
+    return [(start, end, owner) for start, end, owner in intervals]
+
+
+def check(cmaps: dict[str, dict[int, int]]) -> dict[str, list[str]]:
+    sources = [source for source in PRECEDENCE if source in cmaps]
+    all_codepoints = set().union(*cmaps.values())
+    conflicts: dict[int, str] = {}
+    gaps: dict[int, str] = {}
+    for codepoint in sorted(all_codepoints):
+        having = [source for source in sources if codepoint in cmaps[source]]
+        owner = assigned_owner(codepoint)
+        if owner is None and len(having) > 1:
+            conflicts[codepoint] = "/".join(having)
+        elif owner is not None and owner in cmaps and owner not in having:
+            gaps[codepoint] = f"{owner} has no glyph, {'/'.join(having)} cleared"
+
+    # A glyph shared by several codepoints is cleared for all of them
+    for source, cmap in cmaps.items():
+        codepoints_by_glyph: dict[int, list[int]] = {}
+        for codepoint, glyph_id in cmap.items():
+            codepoints_by_glyph.setdefault(glyph_id, []).append(codepoint)
+        for codepoints in codepoints_by_glyph.values():
+            cleared = [cp for cp in codepoints if assigned_owner(cp) not in (None, source)]
+            if cleared:
+                for codepoint in codepoints:
+                    if codepoint not in cleared and codepoint not in gaps:
+                        gaps[codepoint] = (f"{source} glyph shared with U+{cleared[0]:04X}, "
+                                           f"which is assigned to {assigned_owner(cleared[0])}")
+
+    unused = [f"U+{start:04X}-{end:04X} ({owner})" if start != end else f"U+{start:04X} ({owner})"
+              for start, end, owner in OVERRIDES
+              if not any(cp in all_codepoints for cp in range(start, end + 1))]
+    return {
+        "conflicts": [format_interval(*interval) for interval in to_intervals(conflicts)],
+        "gaps": [format_interval(*interval) for interval in to_intervals(gaps)],
+        "unused": unused,
+    }
+
+
+def format_interval(start: int, end: int, detail: str) -> str:
+    codepoints = f"U+{start:04X}" if start == end else f"U+{start:04X}-{end:04X}"
+    return f"{codepoints:<16} {detail}"
+
+
+def main() -> None:
+    if len(sys.argv) < 3:
+        raise ValueError("Invalid argument")
+    map_file = sys.argv[1]
+    cmaps = {}
+    for arg in sys.argv[2:]:
+        source, _, font_file = arg.partition("=")
+        if source not in PRECEDENCE or not font_file:
+            raise ValueError("Invalid argument:", arg)
+        cmaps[source] = sfnt.read_cmap(font_file)
+
+    intervals = ownership_map(cmaps)
+    with open(map_file, "w") as f:
+        json.dump([[start, end, owner] for start, end, owner in intervals], f)
+
+    counts = {source: 0 for source in PRECEDENCE}
+    for start, end, owner in intervals:
+        counts[owner] += end - start + 1
+    print("Ownership:", ", ".join(f"{source} {count}" for source, count in counts.items()), flush=True)
+    for kind, lines in check(cmaps).items():
+        if lines:
+            print(f"Ownership {kind}:", *lines, sep="\n  ", flush=True)
+
+
+if __name__ == "__main__":
+    main()
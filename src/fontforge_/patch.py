@@ -3,23 +3,48 @@
 import sys
 import fontforge
 import util
-
-if len(sys.argv) < 3:
-    raise ValueError("Invalid argument")
-
-FONT_FILE = sys.argv[1]
-PATCH_FILES = sys.argv[2:-1]
-BUILD_FILE = sys.argv[-1]
+import cache
+import telemetry
 
 
 def main() -> None:
-    font = fontforge.open(FONT_FILE)
-    for patch_file in PATCH_FILES:
-        font.mergeFonts(patch_file)
-        util.log("Patched:", patch_file, "->", BUILD_FILE)
-
-    util.font_into_file(font, BUILD_FILE)
-    util.log("Generated:", BUILD_FILE)
+    if len(sys.argv) < 3:
+        raise ValueError("Invalid argument")
+    font_file = sys.argv[1]
+    patch_files = sys.argv[2:-1]
+    build_file = sys.argv[-1]
+
+    key = cache.stage_key(
+        "patch",
+        [font_file, *patch_files],
+        [sys.modules[__name__], util],
+        toolchain=fontforge.version(),
+    )
+    with telemetry.stage("patch", None, [font_file, *patch_files], [build_file]) as record:
+        if cache.restore(key, [build_file]):
+            record.cached = True
+            util.log("Restored:", build_file)
+            return
+
+        with record.phase("open"):
+            font = fontforge.open(font_file)
+        record.glyphs_in = util.font_glyph_count(font)
+        with record.phase("transform"):
+            patch(font, patch_files)
+        record.glyphs_out = util.font_glyph_count(font)
+
+        with record.phase("generate"):
+            util.font_into_file(font, build_file)
+        cache.store(key, [build_file])
+    util.log("Generated:", build_file)
+
+
+def patch(font, patches: list) -> None:
+    # `patches` may contain both file paths and opened fonts
+    for patch_font in patches:
+        font.mergeFonts(patch_font)
+        name = patch_font if isinstance(patch_font, str) else patch_font.fontname
+        util.log("Patched:", name, "->", font.fontname)
 
 
 if __name__ == "__main__":
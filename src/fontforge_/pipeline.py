@@ -0,0 +1,104 @@
+# pyright: reportMissingImports=false
+
+import sys
+from os import makedirs
+from os.path import join
+from typing import Final
+import fontforge
+import util
+import sfnt
+import telemetry
+import reproducible
+import properties as P
+import modify_hack
+import modify_ibm_plex_sans_jp
+import merge
+import bundle_nf
+import braille_gen
+import patch
+from merge import FontStyle, is_font_style
+
+# Build every style in one process.  The live font objects are passed from
+# stage to stage and only the final artifact is generated, instead of
+# writing and reopening the intermediate TTFs in `.cache/`.
+
+# style -> (Hack source, IBM Plex Sans JP source)
+SOURCE_FONTS: Final[dict[FontStyle, tuple[str, str]]] = {
+    "Regular": ("Agave-Regular.ttf", "IBMPlexSansJP-Medium.ttf"),
+    "Bold": ("Agave-Bold.ttf", "IBMPlexSansJP-Bold.ttf"),
+    "Italic": ("Agave-Regular.ttf", "IBMPlexSansJP-Medium.ttf"),
+    "BoldItalic": ("Agave-Bold.ttf", "IBMPlexSansJP-Bold.ttf"),
+}
+
+
+def main() -> None:
+    if len(sys.argv) < 3:
+        raise ValueError("Invalid argument")
+    glyphs_dir = sys.argv[1]
+    build_dir = sys.argv[2]
+    styles = sys.argv[3:] or list(SOURCE_FONTS)
+    for style in styles:
+        if not is_font_style(style):
+            raise ValueError("Invalid font style:", style)
+
+    makedirs(build_dir, exist_ok=True)
+    build_files = [join(build_dir, f"{P.FAMILY}-{style}.ttf") for style in styles]
+    with telemetry.stage("pipeline", ",".join(styles), [glyphs_dir], build_files):
+        build(glyphs_dir, build_dir, styles)
+
+
+def build(glyphs_dir: str, build_dir: str, styles: list[FontStyle]) -> list[str]:
+    patches = [
+        bundle_nf.build(join(glyphs_dir, "FontPatcher-glyphs")),
+        braille_gen.build(),
+    ]
+    # The live font is transformed in fontforge
+    bundle_nf.transform(patches[0])
+
+    # Styles sharing the same sources (e.g. Regular and Italic) reuse the modified fonts
+    groups: dict[tuple[str, str], list[FontStyle]] = {}
+    for style in styles:
+        groups.setdefault(SOURCE_FONTS[style], []).append(style)
+
+    build_files = []
+    for (hack_file, ibm_file), group_styles in groups.items():
+        en_font = open_modified(join(glyphs_dir, hack_file), modify_hack.modify)
+        jp_font = open_modified(join(glyphs_dir, ibm_file), modify_ibm_plex_sans_jp.modify)
+        font = merge.merge_base(en_font, jp_font)
+        en_font.close()
+        jp_font.close()
+
+        def on_style(font, style: FontStyle) -> None:
+            build_file = join(build_dir, f"{P.FAMILY}-{style}.ttf")
+            patch.patch(font, patches)
+            generate(font, build_file)
+            build_files.append(build_file)
+
+        merge.derive_styles(font, group_styles, on_style)
+        font.close()
+
+    for patch_font in patches:
+        patch_font.close()
+    return build_files
+
+
+def open_modified(font_file: str, modify):
+    font = fontforge.open(font_file)
+    modify(font)
+    util.log("Modified:", font_file)
+    return font
+
+
+def generate(font, build_file: str) -> None:
+    with telemetry.phase("generate"):
+        util.font_into_file(font, build_file, close=False)
+    # Same fix as `fonttools_/main.py`, patched directly into the generated file
+    sfnt.set_fixed_pitch(build_file)
+    timestamp = reproducible.head_timestamp()
+    if timestamp is not None:
+        sfnt.set_timestamps(build_file, timestamp)
+    util.log("Generated:", build_file)
+
+
+if __name__ == "__main__":
+    main()
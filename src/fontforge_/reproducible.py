@@ -0,0 +1,137 @@
+import os
+import sys
+import json
+import hashlib
+import subprocess
+from datetime import datetime, timezone
+from os.path import join, dirname, abspath, relpath, isdir
+import sfnt
+
+# Reproducible builds.
+#
+# The build date is taken from SOURCE_DATE_EPOCH (the Makefile sets it to the
+# commit time) instead of the clock: the date of the UniqueID name and the
+# head created/modified timestamps of the built fonts.  fontforge and fontTools
+# read the variable themselves for the timestamps of intermediate files.
+# Without it, the current time is used as before.
+#
+# reproducible.py check WORK_DIR [MAKE_GOAL ...]
+#   Builds twice (default goals: fontforge fonttools), each with its own
+#   CACHE_DIR, BUILD_DIR and stage cache under WORK_DIR, then compares them.
+# reproducible.py compare DIR DIR
+#   Compares the fonts of two build (or cache) directories table by table.
+#   Exits with 1 when they differ.
+
+ROOT_DIR = abspath(join(dirname(__file__), "..", ".."))
+DEFAULT_GOALS = ("fontforge", "fonttools")
+FONT_SUFFIXES = (".ttf", ".otf", ".woff2", ".sfd")
+
+# Seconds from 1904-01-01 (head LONGDATETIME) to 1970-01-01
+HEAD_EPOCH_DIFF = 2082844800
+
+
+def source_date_epoch() -> int | None:
+    value = os.environ.get("SOURCE_DATE_EPOCH", "")
+    return int(value) if value else None
+
+
+def source_date() -> datetime:
+    epoch = source_date_epoch()
+    if epoch is None:
+        return datetime.now(timezone.utc)
+    return datetime.fromtimestamp(epoch, timezone.utc)
+
+
+def head_timestamp() -> int | None:
+    # head.created/modified value of SOURCE_DATE_EPOCH
+    epoch = source_date_epoch()
+    return None if epoch is None else epoch + HEAD_EPOCH_DIFF
+
+
+def main() -> None:
+    args = sys.argv[1:]
+    if len(args) >= 2 and args[0] == "check":
+        ok = check(abspath(args[1]), args[2:] or list(DEFAULT_GOALS))
+    elif len(args) == 3 and args[0] == "compare":
+        ok = print_differences(args[1], args[2])
+    else:
+        raise ValueError("Invalid argument")
+    if not ok:
+        sys.exit(1)
+
+
+def check(work_dir: str, goals: list[str]) -> bool:
+    runs = [join(work_dir, str(i)) for i in (1, 2)]
+    for run_dir in runs:
+        build(run_dir, goals)
+    ok = True
+    for subdir in ("build", "cache"):
+        ok = print_differences(join(runs[0], subdir), join(runs[1], subdir)) and ok
+    return ok
+
+
+def build(run_dir: str, goals: list[str]) -> None:
+    env = dict(os.environ, AGAVEJP_CACHE_DIR=join(run_dir, "stage-cache"))
+    print("Building:", run_dir, flush=True)
+    subprocess.run(
+        ["make", "--no-print-directory", *goals,
+         f"CACHE_DIR={join(run_dir, 'cache')}", f"BUILD_DIR={join(run_dir, 'build')}"],
+        cwd=ROOT_DIR, env=env, check=True,
+    )
+
+
+def font_files(directory: str) -> list[str]:
+    files: list[str] = []
+    if not isdir(directory):
+        return files
+    for parent, _, names in os.walk(directory):
+        files.extend(relpath(join(parent, name), directory) for name in names if name.endswith(FONT_SUFFIXES))
+    return sorted(files)
+
+
+def table_hashes(filename: str) -> dict[str, str]:
+    # tag -> digest of the table data; the whole file for non-sfnt files
+    with open(filename, "rb") as f:
+        data = f.read()
+    if not data.startswith((b"\x00\x01\x00\x00", b"OTTO", b"true")):
+        return {"file": hashlib.sha256(data).hexdigest()}
+    hashes = {}
+    for tag, (_, offset, length) in sfnt.read_table_directory(data).items():
+        table = data[offset:offset + length]
+        if tag == "head":
+            # checkSumAdjustment differs whenever any table does
+            table = table[:sfnt.HEAD_CHECKSUM_ADJUSTMENT_OFFSET] + table[sfnt.HEAD_CHECKSUM_ADJUSTMENT_OFFSET + 4:]
+        hashes[tag] = hashlib.sha256(table).hexdigest()
+    return hashes
+
+
+def compare(dir_a: str, dir_b: str) -> dict[str, list[str]]:
+    # File -> differing tables ("missing" when only in one directory)
+    files_a = font_files(dir_a)
+    files_b = font_files(dir_b)
+    differences = {}
+    for name in sorted(set(files_a) | set(files_b)):
+        if name not in files_a or name not in files_b:
+            differences[name] = ["missing"]
+            continue
+        hashes_a = table_hashes(join(dir_a, name))
+        hashes_b = table_hashes(join(dir_b, name))
+        tables = [tag for tag in sorted(hashes_a.keys() | hashes_b.keys()) if hashes_a.get(tag) != hashes_b.get(tag)]
+        if tables:
+            differences[name] = tables
+    return differences
+
+
+def print_differences(dir_a: str, dir_b: str) -> bool:
+    differences = compare(dir_a, dir_b)
+    count = len(set(font_files(dir_a)) | set(font_files(dir_b)))
+    if not differences:
+        print(f"Reproducible: {dir_a} {dir_b} ({count} files)", flush=True)
+        return True
+    print(f"Not reproducible: {dir_a} {dir_b} ({len(differences)} of {count} files)", flush=True)
+    print(json.dumps(differences, indent=2), flush=True)
+    return False
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+import os
+import sys
+import json
+import time
+import subprocess
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from os.path import join, dirname, abspath
+import telemetry
+
+# Memory-aware build driver.
+#
+# Runs the stages of the Makefile as `make <target>` in parallel, within a
+# memory budget and a job limit instead of a fixed `make -jN`.  The peak RSS
+# and duration of each stage are taken from its last telemetry record
+# (DEFAULT_* before the first build).  Ready stages are started in order of
+# their critical path length, so the merges start as early as possible.  A
+# per-stage timeline is written to `<CACHE_DIR>/schedule.json`.
+#
+# The stages in WORKER_VARIABLES fork a pool of workers.  Their memory is
+# the peak RSS of the main process plus that of one worker (the peak RSS of
+# the children) times the number of workers, and the number of workers is
+# chosen when the stage starts: as many as the free memory and the free CPUs
+# allow, at least one.  It is passed to make as the variable that sizes the
+# pool.  Every running stage holds one CPU per process, so --jobs limits the
+# number of stages, not of processes.
+#
+# The goal itself (`make fontforge` or `make fonttools`) is the last stage,
+# so its recipe (e.g. the ownership report) runs as in a plain make.
+#
+# scheduler.py [--memory MB] [--jobs N] [--cpus N] [fontforge|fonttools] [VAR=VALUE ...]
+#   --memory  budget in MiB (default: 90% of MemAvailable)
+#   --jobs    concurrent stages (default: CPU count)
+#   --cpus    concurrent processes of all stages (default: CPU count)
+#   VAR=VALUE make variables passed to every make call (e.g. SUBSET=ascii)
+
+# Estimates used until a stage has a telemetry record
+DEFAULT_RSS_MB = {
+    "modify_hack": 300,
+    "presubset_ibm": 500,
+    "modify_ibm_plex_sans_jp": 1500,
+    "merge": 3000,
+    "bundle_nf": 1000,
+    "braille_gen": 200,
+    "fontforge": 200,
+    "fonttools": 1500,
+}
+DEFAULT_DURATION = {
+    "modify_hack": 10.0,
+    "presubset_ibm": 5.0,
+    "modify_ibm_plex_sans_jp": 60.0,
+    "merge": 300.0,
+    "bundle_nf": 30.0,
+    "braille_gen": 5.0,
+    "fontforge": 5.0,
+    "fonttools": 30.0,
+}
+# Peak RSS of one pool worker until the stage has a telemetry record
+DEFAULT_WORKER_RSS_MB = {
+    "merge": 500,
+    "bundle_nf": 300,
+}
+# Make variable sizing the worker pool of a stage
+WORKER_VARIABLES = {
+    "merge": "HINT_WORKERS",
+    "bundle_nf": "BUNDLE_NF_WORKERS",
+}
+MEMORY_BUDGET_RATIO = 0.9
+
+ROOT_DIR = abspath(join(dirname(__file__), "..", ".."))
+
+
+@dataclass
+class Node:
+    name: str
+    stage: str
+    target: str
+    deps: list[str] = field(default_factory=list)
+    rss_mb: float = 0.0
+    worker_rss_mb: float = 0.0
+    workers: int = 1
+    duration: float = 0.0
+    priority: float = 0.0
+
+    def memory_mb(self, workers: int) -> float:
+        return self.rss_mb + self.worker_rss_mb * workers
+
+    def max_workers(self, memory: float, cpus: int) -> int:
+        # Workers fitting in the memory and the CPUs, at least one
+        if self.stage not in WORKER_VARIABLES:
+            return 1
+        by_memory = int((memory - self.rss_mb) // self.worker_rss_mb) if self.worker_rss_mb > 0 else cpus
+        return max(1, min(cpus, by_memory))
+
+
+def main() -> None:
+    args = sys.argv[1:]
+    memory = None
+    jobs = os.cpu_count() or 1
+    cpus = os.cpu_count() or 1
+    goal = "fontforge"
+    variables = []
+    while args:
+        arg = args.pop(0)
+        if arg == "--memory" and args:
+            memory = float(args.pop(0))
+        elif arg == "--jobs" and args:
+            jobs = int(args.pop(0))
+        elif arg == "--cpus" and args:
+            cpus = int(args.pop(0))
+        elif "=" in arg:
+            variables.append(arg)
+        elif arg in ("fontforge", "fonttools"):
+            goal = arg
+        else:
+            raise ValueError("Invalid argument:", arg)
+    if memory is None:
+        memory = available_memory_mb() * MEMORY_BUDGET_RATIO
+
+    # The Makefile paths are relative to the repository root
+    os.chdir(ROOT_DIR)
+    cache_dir = make_variable("CACHE_DIR", variables)
+    os.makedirs(cache_dir, exist_ok=True)
+    nodes = build_graph(cache_dir, goal)
+    estimate(nodes, telemetry.load_records(join(cache_dir, "telemetry")))
+    timeline, ok = run(nodes, memory, jobs, cpus, variables)
+
+    with open(join(cache_dir, "schedule.json"), "w") as f:
+        json.dump({"memory_budget_mb": memory, "jobs": jobs, "cpus": cpus, "stages": timeline}, f, indent=2)
+    print(report(timeline), flush=True)
+    if not ok:
+        sys.exit(1)
+
+
+def available_memory_mb() -> float:
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return float(os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")) / 1024 / 1024
+
+
+def make_variable(name: str, variables: list[str]) -> str:
+    # Value of a Makefile variable, with the command line variables applied
+    result = subprocess.run(
+        ["make", "--no-print-directory", "-s", "--eval", "print-%: ; @echo $($*)", f"print-{name}", *variables],
+        check=True, capture_output=True, text=True,
+    )
+    return result.stdout.strip()
+
+
+def build_graph(cache_dir: str, goal: str) -> dict[str, Node]:
+    # Mirrors the file rules of the Makefile
+    def cached(name: str) -> str:
+        return join(cache_dir, name)
+
+    nodes = [
+        Node("modify_hack:Regular", "modify_hack", cached("modified-Hack-Regular.ttf")),
+        Node("modify_hack:Bold", "modify_hack", cached("modified-Hack-Bold.ttf")),
+        Node("presubset_ibm:Medium", "presubset_ibm", cached("presubset-IBMPlexSansJP-Medium.ttf")),
+        Node("presubset_ibm:Bold", "presubset_ibm", cached("presubset-IBMPlexSansJP-Bold.ttf")),
+        Node("modify_ibm:Medium", "modify_ibm_plex_sans_jp", cached("modified-IBMPlexSansJP-Medium.ttf"),
+             ["presubset_ibm:Medium"]),
+        Node("modify_ibm:Bold", "modify_ibm_plex_sans_jp", cached("modified-IBMPlexSansJP-Bold.ttf"),
+             ["presubset_ibm:Bold"]),
+        Node("merge:Regular", "merge", cached("merged-AgaveJP-Regular.ttf"),
+             ["modify_hack:Regular", "modify_ibm:Medium"]),
+        Node("merge:Bold", "merge", cached("merged-AgaveJP-Bold.ttf"),
+             ["modify_hack:Bold", "modify_ibm:Bold"]),
+        Node("bundle_nf", "bundle_nf", cached("NerdFonts.ttf")),
+        Node("braille_gen", "braille_gen", cached("Braille.ttf")),
+    ]
+    # The goal runs last, after the files it depends on
+    nodes.append(Node(goal, goal, goal, ["merge:Regular", "merge:Bold", "bundle_nf", "braille_gen"]))
+    return {node.name: node for node in nodes}
+
+
+def estimate(nodes: dict[str, Node], records: list[dict]) -> None:
+    # Peak RSS (main process, one child) and duration of the last uncached
+    # run of each stage, looked up by output file, then by stage
+    measured: dict[str, tuple[float, float, float]] = {}
+    for record in records:
+        if record["cached"] or record["status"] != "ok":
+            continue
+        values = (record["peak_rss_kb"] / 1024, record["peak_rss_children_kb"] / 1024, record["wall_time"])
+        for output in record["outputs"]:
+            measured[output["path"]] = values
+        measured.setdefault(record["stage"], values)
+
+    for node in nodes.values():
+        default = (DEFAULT_RSS_MB[node.stage], DEFAULT_WORKER_RSS_MB.get(node.stage, 0.0),
+                   DEFAULT_DURATION[node.stage])
+        rss, child_rss, duration = measured.get(node.target, measured.get(node.stage, default))
+        if node.stage in WORKER_VARIABLES:
+            node.rss_mb = rss
+            node.worker_rss_mb = child_rss
+        else:
+            # Children run one at a time
+            node.rss_mb = max(rss, child_rss)
+        node.duration = duration
+
+    # Critical path: own duration plus the longest chain of dependents
+    dependents: dict[str, list[str]] = {name: [] for name in nodes}
+    for node in nodes.values():
+        for dep in node.deps:
+            dependents[dep].append(node.name)
+
+    def priority(name: str) -> float:
+        node = nodes[name]
+        if not node.priority:
+            node.priority = node.duration + max((priority(d) for d in dependents[name]), default=0.0)
+        return node.priority
+
+    for name in nodes:
+        priority(name)
+
+
+def run(nodes: dict[str, Node], memory: float, jobs: int, cpus: int,
+        variables: list[str]) -> tuple[list[dict], bool]:
+    done: set[str] = set()
+    running: dict[Future, Node] = {}
+    timeline: list[dict] = []
+    used_memory = 0.0
+    used_cpus = 0
+    failed = False
+    origin = time.perf_counter()
+
+    def make(node: Node) -> tuple[int, float, float]:
+        start = time.perf_counter() - origin
+        pool = [f"{WORKER_VARIABLES[node.stage]}={node.workers}"] if node.stage in WORKER_VARIABLES else []
+        result = subprocess.run(["make", "--no-print-directory", node.target, *variables, *pool])
+        return result.returncode, start, time.perf_counter() - origin
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = sorted(nodes.values(), key=lambda node: -node.priority)
+        while pending or running:
+            if not failed:
+                for node in list(pending):
+                    if len(running) >= jobs or (running and used_cpus >= cpus):
+                        break
+                    if not all(dep in done for dep in node.deps):
+                        continue
+                    # A stage over the budget still runs, but alone
+                    if running and used_memory + node.memory_mb(1) > memory:
+                        continue
+                    pending.remove(node)
+                    node.workers = node.max_workers(memory - used_memory, max(1, cpus - used_cpus))
+                    used_memory += node.memory_mb(node.workers)
+                    used_cpus += node.workers
+                    running[executor.submit(make, node)] = node
+                    print(f"Schedule: start {node.name} (~{node.memory_mb(node.workers):.0f} MB, "
+                          f"{node.workers} processes, {used_memory:.0f}/{memory:.0f} MB)", flush=True)
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                node = running.pop(future)
+                used_memory -= node.memory_mb(node.workers)
+                used_cpus -= node.workers
+                returncode, start, end = future.result()
+                timeline.append({
+                    "stage": node.name,
+                    "target": node.target,
+                    "start": start,
+                    "end": end,
+                    "estimated_rss_mb": node.memory_mb(node.workers),
+                    "workers": node.workers,
+                    "status": "ok" if returncode == 0 else "error",
+                })
+                if returncode == 0:
+                    done.add(node.name)
+                else:
+                    failed = True
+    return timeline, not failed and not pending
+
+
+def report(timeline: list[dict], width: int = 40) -> str:
+    total = max((entry["end"] for entry in timeline), default=0.0) or 1.0
+    lines = []
+    for entry in sorted(timeline, key=lambda entry: entry["start"]):
+        begin = int(entry["start"] / total * width)
+        length = max(1, int((entry["end"] - entry["start"]) / total * width))
+        bar = " " * begin + "#" * length
+        lines.append(f"{entry['stage']:<22} {bar:<{width}} {entry['start']:7.1f}s -> {entry['end']:7.1f}s  "
+                     f"{entry['estimated_rss_mb']:6.0f} MB  {entry['status']}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    main()
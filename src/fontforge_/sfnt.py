@@ -0,0 +1,122 @@
+import struct
+
+# Helpers to read and patch generated TrueType files without reparsing the
+# whole font.
+# Only the standard library is used, so these also work in the fontforge image.
+
+HEAD_CHECKSUM_ADJUSTMENT_OFFSET = 8
+CHECKSUM_MAGIC = 0xB1B0AFBA
+
+
+def read_table_directory(data: bytes) -> dict[str, tuple[int, int, int]]:
+    # tag -> (checksum, offset, length)
+    num_tables = struct.unpack_from(">H", data, 4)[0]
+    tables = {}
+    for i in range(num_tables):
+        tag, checksum, offset, length = struct.unpack_from(">4sLLL", data, 12 + 16 * i)
+        tables[tag.decode("latin-1")] = (checksum, offset, length)
+    return tables
+
+
+def calc_checksum(data: bytes) -> int:
+    padded = data + b"\0" * (-len(data) % 4)
+    return sum(struct.unpack(f">{len(padded) // 4}L", padded)) & 0xFFFFFFFF
+
+
+def patch_table(filename: str, tag: str, offset: int, fmt: str, value: int) -> None:
+    with open(filename, "rb") as f:
+        data = bytearray(f.read())
+
+    tables = read_table_directory(data)
+    if tag not in tables:
+        raise ValueError(f"No such table: {tag}")
+    _, table_offset, table_length = tables[tag]
+    if offset + struct.calcsize(fmt) > table_length:
+        raise ValueError(f"Out of table: {tag} offset {offset}")
+    struct.pack_into(fmt, data, table_offset + offset, value)
+
+    _fix_checksums(data)
+    with open(filename, "wb") as f:
+        f.write(data)
+
+
+def _fix_checksums(data: bytearray) -> None:
+    num_tables = struct.unpack_from(">H", data, 4)[0]
+    _, head_offset, _ = read_table_directory(data)["head"]
+    struct.pack_into(">L", data, head_offset + HEAD_CHECKSUM_ADJUSTMENT_OFFSET, 0)
+
+    for i in range(num_tables):
+        record = 12 + 16 * i
+        _, _, offset, length = struct.unpack_from(">4sLLL", data, record)
+        checksum = calc_checksum(bytes(data[offset:offset + length]))
+        struct.pack_into(">L", data, record + 4, checksum)
+
+    adjustment = (CHECKSUM_MAGIC - calc_checksum(bytes(data))) & 0xFFFFFFFF
+    struct.pack_into(">L", data, head_offset + HEAD_CHECKSUM_ADJUSTMENT_OFFSET, adjustment)
+
+
+def set_fixed_pitch(filename: str, is_fixed_pitch: int = 1) -> None:
+    # post.isFixedPitch (uint32) is at offset 12
+    patch_table(filename, "post", 12, ">L", is_fixed_pitch)
+
+
+def set_timestamps(filename: str, timestamp: int) -> None:
+    # head.created and head.modified (LONGDATETIME) are at offsets 20 and 28
+    patch_table(filename, "head", 20, ">q", timestamp)
+    patch_table(filename, "head", 28, ">q", timestamp)
+
+
+def read_cmap(filename: str) -> dict[int, int]:
+    # codepoint -> glyph id from the Unicode subtable with the widest coverage
+    # (format 12 over format 4)
+    with open(filename, "rb") as f:
+        data = f.read()
+    _, cmap_offset, _ = read_table_directory(data)["cmap"]
+    num_subtables = struct.unpack_from(">H", data, cmap_offset + 2)[0]
+    subtables = {}
+    for i in range(num_subtables):
+        platform_id, encoding_id, offset = struct.unpack_from(">HHL", data, cmap_offset + 4 + 8 * i)
+        subtable_offset = cmap_offset + offset
+        subtable_format = struct.unpack_from(">H", data, subtable_offset)[0]
+        subtables[(platform_id, encoding_id, subtable_format)] = subtable_offset
+
+    for key, read in [((3, 10, 12), _read_cmap_format12), ((0, 4, 12), _read_cmap_format12),
+                      ((3, 1, 4), _read_cmap_format4), ((0, 3, 4), _read_cmap_format4)]:
+        if key in subtables:
+            return read(data, subtables[key])
+    raise ValueError(f"No Unicode cmap subtable: {filename}")
+
+
+def _read_cmap_format4(data: bytes, offset: int) -> dict[int, int]:
+    seg_count = struct.unpack_from(">H", data, offset + 6)[0] // 2
+    end_codes = struct.unpack_from(f">{seg_count}H", data, offset + 14)
+    start_codes = struct.unpack_from(f">{seg_count}H", data, offset + 16 + 2 * seg_count)
+    deltas = struct.unpack_from(f">{seg_count}h", data, offset + 16 + 4 * seg_count)
+    range_offsets_at = offset + 16 + 6 * seg_count
+    range_offsets = struct.unpack_from(f">{seg_count}H", data, range_offsets_at)
+
+    cmap = {}
+    for i in range(seg_count):
+        for codepoint in range(start_codes[i], end_codes[i] + 1):
+            if codepoint == 0xffff:
+                continue
+            if range_offsets[i] == 0:
+                glyph_id = (codepoint + deltas[i]) & 0xffff
+            else:
+                at = range_offsets_at + 2 * i + range_offsets[i] + 2 * (codepoint - start_codes[i])
+                glyph_id = struct.unpack_from(">H", data, at)[0]
+                if glyph_id != 0:
+                    glyph_id = (glyph_id + deltas[i]) & 0xffff
+            if glyph_id != 0:
+                cmap[codepoint] = glyph_id
+    return cmap
+
+
+def _read_cmap_format12(data: bytes, offset: int) -> dict[int, int]:
+    num_groups = struct.unpack_from(">L", data, offset + 12)[0]
+    cmap = {}
+    for i in range(num_groups):
+        start, end, start_glyph_id = struct.unpack_from(">LLL", data, offset + 16 + 12 * i)
+        for codepoint in range(start, end + 1):
+            cmap[codepoint] = start_glyph_id + codepoint - start
+    return cmap
@@ -0,0 +1,99 @@
+import os
+import glob
+import hashlib
+from collections.abc import Iterable
+
+# Codepoint subset for fast development builds.
+#
+# With AGAVEJP_SUBSET set, every stage only works on the glyphs of the given
+# codepoints: the modify stages clear the other glyphs right after opening
+# the source fonts, bundle_nf only transfers the icons in the subset and
+# braille_gen only draws the patterns in it.  The spec is a comma separated
+# list of
+#   - named sets (see NAMED_SETS), e.g. `ascii,kana`
+#   - codepoints and ranges, e.g. `U+4E00`, `U+4E00-4E0F`
+#   - text files (globs allowed), whose characters are added,
+#     e.g. `images/text/*.txt`
+#
+# Unset or empty, nothing is cleared and the full font is built.
+
+NAMED_SETS: dict[str, list[tuple[int, int]]] = {
+    "ascii": [(0x20, 0x7e)],
+    "latin1": [(0xa0, 0xff)],
+    "kana": [(0x3041, 0x3096), (0x3099, 0x30ff)],
+    "cjk-symbols": [(0x3000, 0x303f)],
+    "fullwidth": [(0xff01, 0xffef)],
+    "box": [(0x2500, 0x259f)],
+    "braille": [(0x2800, 0x28ff)],
+    "powerline": [(0xe0a0, 0xe0d4)],
+}
+
+UNICODE_MAX = 0x10ffff
+
+
+def parse(spec: str) -> frozenset[int]:
+    codepoints: set[int] = set()
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        if item.lower() in NAMED_SETS:
+            for start, end in NAMED_SETS[item.lower()]:
+                codepoints.update(range(start, end + 1))
+        elif item.upper().startswith("U+"):
+            start, _, end = item[2:].partition("-")
+            try:
+                codepoints.update(range(int(start, 16), int(end or start, 16) + 1))
+            except ValueError:
+                raise ValueError("Invalid codepoint range:", item)
+        else:
+            files = sorted(glob.glob(item))
+            if not files:
+                raise ValueError("Unknown subset or no such file:", item)
+            for file in files:
+                with open(file, encoding="utf-8") as f:
+                    codepoints.update(ord(c) for c in f.read() if ord(c) >= 0x20)
+    return frozenset(codepoints)
+
+
+SPEC = os.environ.get("AGAVEJP_SUBSET", "")
+CODEPOINTS: frozenset[int] | None = parse(SPEC) if SPEC else None
+
+
+def enabled() -> bool:
+    return CODEPOINTS is not None
+
+
+def contains(codepoint: int) -> bool:
+    return CODEPOINTS is None or codepoint in CODEPOINTS
+
+
+def intersects(codepoints: Iterable[int]) -> bool:
+    return any(contains(codepoint) for codepoint in codepoints)
+
+
+def digest() -> str:
+    # Part of the cache keys of the stages that apply the subset
+    if CODEPOINTS is None:
+        return ""
+    return hashlib.sha256(",".join(map(str, sorted(CODEPOINTS))).encode("utf-8")).hexdigest()
+
+
+def font_apply(font, codepoints: Iterable[int] = (), names: Iterable[str] = ()) -> None:
+    # Clear the glyphs outside of the subset.  `codepoints` and `names` are
+    # glyphs the calling stage needs on top of it.
+    if CODEPOINTS is None:
+        return
+    keep_codepoints = CODEPOINTS.union(codepoints)
+    keep_names = {".notdef", *names}
+
+    font.selection.none()
+    for glyph in font.glyphs():
+        if glyph.glyphname in keep_names:
+            continue
+        mapped = [glyph.unicode] + [alt[0] for alt in glyph.altuni or ()]
+        if any(0 <= codepoint <= UNICODE_MAX and codepoint in keep_codepoints for codepoint in mapped):
+            continue
+        font.selection.select(("more",), glyph.glyphname)
+    font.clear()
+    font.selection.none()
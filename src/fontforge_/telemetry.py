@@ -0,0 +1,171 @@
+import sys
+import os
+import re
+import json
+import time
+import resource
+from contextlib import contextmanager
+from collections.abc import Iterator
+from os.path import join, basename, exists, getsize
+
+# Per-stage build telemetry.
+#
+# Each stage run writes one JSON record to TELEMETRY_DIR with its wall/CPU
+# time, peak RSS, glyph counts, input/output sizes and the time spent in the
+# open/transform/hint/generate phases.  `python3 telemetry.py [DIR]` prints
+# a summary table of the records.
+#
+# Environment variables:
+#   AGAVEJP_TELEMETRY=0           disable the records
+#   AGAVEJP_TELEMETRY_DIR=<dir>   output directory (default: .cache/telemetry)
+
+ENABLED = os.environ.get("AGAVEJP_TELEMETRY", "1") != "0"
+TELEMETRY_DIR = os.environ.get("AGAVEJP_TELEMETRY_DIR", join(".cache", "telemetry"))
+
+PHASES = ("open", "transform", "hint", "generate")
+
+
+class StageRecord:
+    def __init__(self, stage: str, style: str | None, inputs: list[str], outputs: list[str]) -> None:
+        self.stage = stage
+        self.style = style
+        self.inputs = inputs
+        self.outputs = outputs
+        self.glyphs_in: int | None = None
+        self.glyphs_out: int | None = None
+        self.cached = False
+        self.phases: dict[str, float] = {}
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+
+# Record of the stage running in this process, used by `phase()`
+_current: StageRecord | None = None
+
+
+@contextmanager
+def stage(name: str,
+          style: str | None = None,
+          inputs: list[str] | None = None,
+          outputs: list[str] | None = None) -> Iterator[StageRecord]:
+    global _current
+    record = StageRecord(name, style, inputs or [], outputs or [])
+    parent, _current = _current, record
+    started_at = time.time()
+    start = time.perf_counter()
+    cpu_start = _cpu_time()
+    status = "error"
+    try:
+        yield record
+        status = "ok"
+    finally:
+        _current = parent
+        if ENABLED:
+            _write(record, {
+                "status": status,
+                "started_at": started_at,
+                "wall_time": time.perf_counter() - start,
+                "cpu_time": _cpu_time() - cpu_start,
+            })
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    # Time a phase of the current stage (no-op outside of a stage)
+    if _current is None:
+        yield
+        return
+    with _current.phase(name):
+        yield
+
+
+def _cpu_time() -> float:
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+def _peak_rss_kb(who: int) -> int:
+    peak = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def _files(paths: list[str]) -> list[dict]:
+    return [{"path": path, "size": getsize(path) if exists(path) else None} for path in paths]
+
+
+def _write(record: StageRecord, times: dict) -> None:
+    data = {
+        "stage": record.stage,
+        "style": record.style,
+        **times,
+        "peak_rss_kb": _peak_rss_kb(resource.RUSAGE_SELF),
+        "peak_rss_children_kb": _peak_rss_kb(resource.RUSAGE_CHILDREN),
+        "glyphs_in": record.glyphs_in,
+        "glyphs_out": record.glyphs_out,
+        "cached": record.cached,
+        "phases": record.phases,
+        "inputs": _files(record.inputs),
+        "outputs": _files(record.outputs),
+    }
+    target = record.style or (basename(record.outputs[0]) if record.outputs else str(os.getpid()))
+    filename = re.sub(r"[^\w.,-]", "_", f"{record.stage}-{target}") + ".json"
+    os.makedirs(TELEMETRY_DIR, exist_ok=True)
+    with open(join(TELEMETRY_DIR, filename), "w") as f:
+        json.dump(data, f, indent=2)
+
+
+def load_records(telemetry_dir: str = TELEMETRY_DIR) -> list[dict]:
+    records = []
+    if not exists(telemetry_dir):
+        return records
+    for filename in sorted(os.listdir(telemetry_dir)):
+        if filename.endswith(".json"):
+            with open(join(telemetry_dir, filename)) as f:
+                records.append(json.load(f))
+    return records
+
+
+def summary(records: list[dict]) -> str:
+    header = ["stage", "style", "wall[s]", "cpu[s]", "rss[MB]", "glyphs", *PHASES, "out[KB]"]
+    rows = []
+    for r in sorted(records, key=lambda r: r["wall_time"], reverse=True):
+        glyphs = f"{r['glyphs_in'] or '-'}->{r['glyphs_out'] or '-'}"
+        if r["cached"]:
+            glyphs = "cached"
+        rss = max(r["peak_rss_kb"], r["peak_rss_children_kb"]) / 1024
+        out_size = sum(o["size"] or 0 for o in r["outputs"]) / 1024
+        rows.append([
+            r["stage"], r["style"] or "-",
+            f"{r['wall_time']:.1f}", f"{r['cpu_time']:.1f}", f"{rss:.0f}", glyphs,
+            *(f"{r['phases'][p]:.1f}" if p in r["phases"] else "-" for p in PHASES),
+            f"{out_size:.0f}",
+        ])
+    rows.append(["total", "", f"{sum(r['wall_time'] for r in records):.1f}",
+                 f"{sum(r['cpu_time'] for r in records):.1f}", "", "", *([""] * len(PHASES)), ""])
+
+    widths = [max(len(str(row[i])) for row in [header, *rows]) for i in range(len(header))]
+    lines = []
+    for row in [header, *rows]:
+        lines.append("  ".join(str(cell).ljust(width) for cell, width in zip(row, widths)).rstrip())
+    return "\n".join(lines)
+
+
+def main() -> None:
+    if len(sys.argv) > 2:
+        raise ValueError("Invalid argument")
+    telemetry_dir = sys.argv[1] if len(sys.argv) == 2 else TELEMETRY_DIR
+    print(summary(load_records(telemetry_dir)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# pyright: reportMissingImports=false
+
+import tempfile
+from os.path import join, basename
+import psMat
+from fontTools.ttLib import TTFont
+import util
+import affine
+
+# Per-glyph transform plan.
+#
+# Width fixes and scalings are recorded as matrices per glyph and composed,
+# then every glyph is transformed once and rounded once in a single pass
+# over the font, instead of one `font.glyphs()` pass (and one transform) per
+# step.  The planned width is tracked so later steps see the width earlier
+# steps set, like they would after applying them one by one.
+#
+# Glyphs edited directly (pens, selections) must not have steps pending.
+#
+# `generate()` writes the font with the plan applied by affine.py at table
+# level instead of by fontforge.
+
+
+class TransformPlan:
+    def __init__(self, font) -> None:
+        self.font = font
+        self._matrices: dict[str, tuple] = {}
+        self._widths: dict[str, int] = {}
+
+    def width(self, glyph) -> int:
+        return self._widths.get(glyph.glyphname, glyph.width)
+
+    def transform(self, glyph, matrix: tuple, width: int | None = None) -> None:
+        name = glyph.glyphname
+        if name in self._matrices:
+            matrix = psMat.compose(self._matrices[name], matrix)
+        self._matrices[name] = matrix
+        if width is not None:
+            self._widths[name] = width
+
+    def resize_width(self, glyph, new_width: int) -> None:
+        # Horizontal scale to `new_width` (util.glyph_riseze_width)
+        self.transform(glyph, psMat.scale(float(new_width) / self.width(glyph), 1), new_width)
+
+    def resize_all_width(self, new_width: int) -> None:
+        # Uniform scale of every glyph to `new_width` (util.font_resize_all_width)
+        for glyph in self.font.glyphs():
+            width = self.width(glyph)
+            if width == new_width:
+                continue
+            if width != 0:
+                self.transform(glyph, psMat.scale(float(new_width) / width))
+            self._widths[glyph.glyphname] = new_width
+
+    def apply(self, round: bool = False) -> None:
+        for glyph in self.font.glyphs():
+            name = glyph.glyphname
+            if name in self._matrices:
+                glyph.transform(self._matrices[name])
+            if name in self._widths:
+                glyph.width = self._widths[name]
+            if round:
+                glyph.round()
+        self._matrices.clear()
+        self._widths.clear()
+
+    def generate(self, filename: str) -> None:
+        # Generated untransformed (which rounds the points), then transformed
+        # and rounded again
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_file = join(tmp_dir, basename(filename))
+            util.font_into_file(self.font, tmp_file, close=False)
+            font = TTFont(tmp_file, recalcBBoxes=False, recalcTimestamp=False)
+            # Cleared glyphs are not generated
+            names = set(font.getGlyphOrder())
+            affine.transform_glyphs(
+                font,
+                {name: matrix for name, matrix in self._matrices.items() if name in names},
+                {name: width for name, width in self._widths.items() if name in names},
+            )
+            font.save(filename)
+            font.close()
+        self._matrices.clear()
+        self._widths.clear()
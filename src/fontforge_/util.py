@@ -3,10 +3,12 @@
 import psMat
 
 
-def font_into_file(font, filename: str) -> None:
+def font_into_file(font, filename: str, close: bool = True) -> None:
     # log("Status:", hex(font.validate()), filename)
-    font.generate(filename, flags=("opentype",))
-    font.close()
+    # FFTM holds the fontforge build date and the generation time
+    font.generate(filename, flags=("opentype", "no-FFTM-table"))
+    if close:
+        font.close()
 
 
 def font_clear_glyph(font, start: int, end: int | None = None) -> None:
@@ -18,6 +20,53 @@ def font_clear_glyph(font, start: int, end: int | None = None) -> None:
     font.selection.none()
 
 
+def font_clear_ranges(font, ranges: list[tuple[int, int]]) -> None:
+    # Clear the glyphs of all `ranges` in a single selection
+    font.selection.none()
+    for start, end in ranges:
+        font.selection.select(("more", "ranges"), start, end)
+    font.clear()
+    font.selection.none()
+
+
+def font_glyph_count(font) -> int:
+    return sum(1 for _ in font.glyphs())
+
+
+def font_encoded_slots(font) -> set[int]:
+    # Encoding slots that hold a glyph
+    slots = set()
+    for glyph in font.glyphs():
+        slots.add(glyph.encoding)
+        for alt in glyph.altuni or ():
+            slots.add(alt[0])
+    return slots
+
+
+def font_transfer(source, font, pairs: list[tuple[int, int]]) -> None:
+    # Copy source[from] to font[to] for each (from, to) in `pairs`.
+    # Consecutive codepoints are copied in a single clipboard round trip.
+    for from_start, to_start, length in _consecutive_runs(pairs):
+        source.selection.select(("ranges",), from_start, from_start + length - 1)
+        source.copy()
+        font.selection.select(("ranges",), to_start, to_start + length - 1)
+        font.paste()
+    source.selection.none()
+    font.selection.none()
+
+
+def _consecutive_runs(pairs: list[tuple[int, int]]) -> list[tuple[int, int, int]]:
+    runs: list[tuple[int, int, int]] = []
+    for from_cp, to_cp in pairs:
+        if runs:
+            from_start, to_start, length = runs[-1]
+            if from_cp == from_start + length and to_cp == to_start + length:
+                runs[-1] = (from_start, to_start, length + 1)
+                continue
+        runs.append((from_cp, to_cp, 1))
+    return runs
+
+
 def font_set_em(font, ascent: int, descent: int, em: int) -> None:
     old_em = font.em
     font.selection.all()
@@ -0,0 +1,222 @@
+import os
+import sys
+import json
+import hashlib
+from os.path import join, dirname, basename, isdir, exists, splitext
+from concurrent.futures import ProcessPoolExecutor
+from fontTools.ttLib import TTFont
+
+sys.path.append(join(dirname(__file__), "..", "fontforge_"))
+import telemetry  # noqa: E402
+
+# Per-glyph fingerprints of the built fonts, and a diff of two builds.
+#
+#   fingerprint.py index INDEX_DIR FONT [FONT ...] [--source STAGE=FONT ...]
+#   fingerprint.py diff OLD NEW [--summary]
+#
+# `index` writes `INDEX_DIR/<font name>.json` with the outline hash, advance
+# width, instruction hash and codepoints of every glyph.  A glyph belongs to
+# the first source font (the output of a stage) that maps one of its
+# codepoints or, for unencoded glyphs, has a glyph of the same name;
+# otherwise to "merge".  The previous index is kept in INDEX_DIR/previous.
+#
+# `diff` compares two indexes (files, or directories of them).  Glyphs are
+# matched by codepoint, unencoded glyphs by name.  A font file can be given
+# instead of an index; it is indexed on the fly without stages.
+
+INDEX_VERSION = 1
+PREVIOUS_DIR = "previous"
+DEFAULT_STAGE = "merge"
+# Global hinting tables, hashed as a whole
+HINTING_TABLES = ("cvt ", "fpgm", "prep")
+
+
+def main() -> None:
+    args = sys.argv[1:]
+    if len(args) >= 3 and args[0] == "index":
+        sources: list[tuple[str, str]] = []
+        if "--source" in args:
+            i = args.index("--source")
+            args, source_args = args[:i], args[i + 1:]
+            for source in source_args:
+                stage, _, font_file = source.partition("=")
+                if not stage or not font_file:
+                    raise ValueError("Invalid argument:", source)
+                sources.append((stage, font_file))
+        index_dir, font_files = args[1], args[2:]
+        os.makedirs(join(index_dir, PREVIOUS_DIR), exist_ok=True)
+        with ProcessPoolExecutor(max_workers=len(font_files)) as executor:
+            jobs = [executor.submit(write_index, font_file, index_dir, sources) for font_file in font_files]
+            for job in jobs:
+                print("Generated:", job.result(), flush=True)
+    elif len(args) in (3, 4) and args[0] == "diff":
+        summary_only = args[3:] == ["--summary"]
+        if len(args) == 4 and not summary_only:
+            raise ValueError("Invalid argument")
+        print(diff_report(load_indexes(args[1]), load_indexes(args[2]), summary_only))
+    else:
+        raise ValueError("Invalid argument")
+
+
+def short_hash(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+def glyph_fingerprint(glyf, name: str) -> tuple[str, str]:
+    # (outline hash, instruction hash); empty glyphs hash to ""
+    glyph = glyf[name]
+    glyph.expand(glyf)
+    if glyph.numberOfContours == 0:
+        return "", ""
+    if glyph.isComposite():
+        outline = repr([
+            (c.glyphName, getattr(c, "x", None), getattr(c, "y", None),
+             getattr(c, "firstPt", None), getattr(c, "secondPt", None),
+             getattr(c, "transform", None))
+            for c in glyph.components
+        ]).encode("utf-8")
+    else:
+        # Points, contour ends and on-curve flags; other flag bits only
+        # affect the encoding
+        outline = b"".join([
+            glyph.coordinates.array.tobytes(),
+            repr(list(glyph.endPtsOfContours)).encode("utf-8"),
+            bytes(flag & 0x01 for flag in glyph.flags),
+        ])
+    program = glyph.program.getBytecode() if hasattr(glyph, "program") else b""
+    return short_hash(outline), short_hash(program) if program else ""
+
+
+def font_index(font_file: str, sources: list[tuple[str, str]] | None = None) -> dict:
+    font = TTFont(font_file, lazy=True)
+    glyf = font["glyf"]
+    hmtx = font["hmtx"]
+    codepoints: dict[str, list[int]] = {}
+    for codepoint, name in sorted(font.getBestCmap().items()):
+        codepoints.setdefault(name, []).append(codepoint)
+    stages = glyph_stages(font, codepoints, sources or [])
+
+    glyphs = {}
+    for name in font.getGlyphOrder():
+        outline, hint = glyph_fingerprint(glyf, name)
+        # Compact rows: [outline, advance, hint, codepoints, stage]
+        glyphs[name] = [outline, hmtx[name][0], hint, codepoints.get(name, []), stages.get(name, DEFAULT_STAGE)]
+    tables = {tag.strip(): short_hash(font.reader[tag]) for tag in HINTING_TABLES if tag in font.reader}
+    font.close()
+    return {"version": INDEX_VERSION, "font": basename(font_file), "tables": tables, "glyphs": glyphs}
+
+
+def glyph_stages(font: TTFont, codepoints: dict[str, list[int]], sources: list[tuple[str, str]]) -> dict[str, str]:
+    stages: dict[str, str] = {}
+    for stage, source_file in sources:
+        source = TTFont(source_file, lazy=True)
+        source_cmap = source.getBestCmap()
+        source_names = set(source.getGlyphOrder())
+        source.close()
+        for name in font.getGlyphOrder():
+            if name in stages:
+                continue
+            if codepoints.get(name):
+                if any(cp in source_cmap for cp in codepoints[name]):
+                    stages[name] = stage
+            elif name in source_names:
+                stages[name] = stage
+    return stages
+
+
+def index_file_name(font_file: str) -> str:
+    return splitext(basename(font_file))[0] + ".json"
+
+
+def write_index(font_file: str, index_dir: str, sources: list[tuple[str, str]] | None = None) -> str:
+    index_file = join(index_dir, index_file_name(font_file))
+    style = splitext(basename(font_file))[0].split("-")[-1]
+    with telemetry.stage("fingerprint", style, [font_file], [index_file]) as record:
+        index = font_index(font_file, sources)
+        record.glyphs_in = record.glyphs_out = len(index["glyphs"])
+        if exists(index_file):
+            os.replace(index_file, join(index_dir, PREVIOUS_DIR, basename(index_file)))
+        with open(index_file, "w") as f:
+            json.dump(index, f, separators=(",", ":"))
+    return index_file
+
+
+def load_indexes(path: str) -> dict[str, dict]:
+    # font name -> index, from an index file, a font file or a directory of index files
+    if isdir(path):
+        names = sorted(name for name in os.listdir(path) if name.endswith(".json"))
+        return {splitext(name)[0]: load_indexes(join(path, name))[splitext(name)[0]] for name in names}
+    if path.endswith(".json"):
+        with open(path) as f:
+            index = json.load(f)
+        if index.get("version") != INDEX_VERSION:
+            raise ValueError("Unsupported index version:", path)
+    else:
+        index = font_index(path)
+    return {splitext(index["font"])[0]: index}
+
+
+def glyph_keys(index: dict) -> dict[str, str]:
+    # Match key -> glyph name: "U+XXXX" for encoded glyphs, the name otherwise
+    keys = {}
+    for name, (_, _, _, codepoints, _) in index["glyphs"].items():
+        if codepoints:
+            for codepoint in codepoints:
+                keys[f"U+{codepoint:04X}"] = name
+        else:
+            keys[name] = name
+    return keys
+
+
+def diff_index(old: dict, new: dict) -> list[tuple[str, str, str, str]]:
+    # [(stage, kind, key, detail)] with kind "+", "-" or "~"
+    old_keys = glyph_keys(old)
+    new_keys = glyph_keys(new)
+    changes = []
+    for key in sorted(old_keys.keys() | new_keys.keys()):
+        if key not in new_keys:
+            name = old_keys[key]
+            changes.append((old["glyphs"][name][4], "-", key, name))
+        elif key not in old_keys:
+            name = new_keys[key]
+            changes.append((new["glyphs"][name][4], "+", key, name))
+        else:
+            old_row = old["glyphs"][old_keys[key]]
+            new_row = new["glyphs"][new_keys[key]]
+            fields = [field for i, field in enumerate(("outline", "advance", "hint")) if old_row[i] != new_row[i]]
+            if old_keys[key] != new_keys[key]:
+                fields.append(f"name {old_keys[key]} -> {new_keys[key]}")
+            if fields:
+                changes.append((new_row[4], "~", key, f"{new_keys[key]}: {', '.join(fields)}"))
+    return changes
+
+
+def diff_report(old_indexes: dict[str, dict], new_indexes: dict[str, dict], summary_only: bool = False) -> str:
+    lines = []
+    for font in sorted(old_indexes.keys() | new_indexes.keys()):
+        if font not in new_indexes or font not in old_indexes:
+            lines.append(f"{font}: only in {'old' if font in old_indexes else 'new'}")
+            continue
+        old, new = old_indexes[font], new_indexes[font]
+        changes = diff_index(old, new)
+        tables = sorted(tag for tag in old["tables"].keys() | new["tables"].keys()
+                        if old["tables"].get(tag) != new["tables"].get(tag))
+        if not changes and not tables:
+            lines.append(f"{font}: no changes")
+            continue
+        lines.append(f"{font}:")
+        if tables:
+            lines.append(f"  tables changed: {', '.join(tables)}")
+        by_stage: dict[str, list[tuple[str, str, str]]] = {}
+        for stage, kind, key, detail in changes:
+            by_stage.setdefault(stage, []).append((kind, key, detail))
+        for stage, stage_changes in sorted(by_stage.items()):
+            counts = {kind: sum(1 for k, _, _ in stage_changes if k == kind) for kind in "+-~"}
+            lines.append(f"  {stage}: {counts['+']} added, {counts['-']} removed, {counts['~']} changed")
+            if not summary_only:
+                lines.extend(f"    {kind} {key:<12} {detail}" for kind, key, detail in stage_changes)
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    main()
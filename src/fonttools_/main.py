@@ -1,60 +1,94 @@
 import sys
-import os
-from os.path import join, basename, splitext
-from xml.etree.ElementTree import ElementTree, parse as xml_parse
-import fontTools.ttx
+from os.path import join, basename, dirname, splitext
+from concurrent.futures import ProcessPoolExecutor
+from typing import Final
+import fontTools
+from fontTools.ttLib import TTFont
+import table_patch
+import optimize
 
-if len(sys.argv) != 4:
-    raise ValueError("Invalid argument")
+sys.path.append(join(dirname(__file__), "..", "fontforge_"))
+import cache  # noqa: E402
+import telemetry  # noqa: E402
+import reproducible  # noqa: E402
 
-FONT_FILE = sys.argv[1]
-CACHE_DIR = sys.argv[2]
-BUILD_FILE = sys.argv[3]
+# Outputs of the merge stage are named `merged-<build file name>`
+MERGED_PREFIX: Final = "merged-"
+
+# Header fields to fix: table tag -> {field: value}
+HEADER_FIXES: Final[dict[str, dict[str, int]]] = {
+    "post": {
+        "isFixedPitch": 1,
+    },
+}
 
 
 def main() -> None:
-    ttx_file_path = join(CACHE_DIR, f"{splitext(basename(FONT_FILE))[0]}.ttx")
-
-    xml = dump_ttx(ttx_file_path, "post")
-    fix_post_table(xml)
-    xml.write(
-        ttx_file_path,
-        encoding="utf-8",
-        xml_declaration=True,
-    )
+    # main.py BUILD_DIR FONT_FILE [FONT_FILE ...] [--patch PATCH_FILE ...]
+    # With --patch, the glyphs of the patch fonts are appended to each font.
+    args = sys.argv[1:]
+    patch_files: list[str] = []
+    if "--patch" in args:
+        i = args.index("--patch")
+        args, patch_files = args[:i], args[i + 1:]
+        if not patch_files:
+            raise ValueError("Invalid argument")
+    if len(args) < 2:
+        raise ValueError("Invalid argument")
+    build_dir = args[0]
+    font_files = args[1:]
+    build_files = [join(build_dir, basename(font_file).removeprefix(MERGED_PREFIX)) for font_file in font_files]
 
-    fontTools.ttx.main(
-        [
-            "-o",
-            BUILD_FILE,
-            "-m",
-            FONT_FILE,
-            ttx_file_path,
-        ]
-    )
-    os.remove(ttx_file_path)
-
-
-def dump_ttx(ttx_file_path: str, table: str) -> ElementTree:
-    fontTools.ttx.main(
-        [
-            "-t",
-            table,
-            "-f",
-            "-o",
-            ttx_file_path,
-            FONT_FILE,
-        ]
+    with ProcessPoolExecutor(max_workers=len(font_files)) as executor:
+        for build_file in executor.map(fix_font_file, font_files, build_files,
+                                       [patch_files] * len(font_files)):
+            print("Generated:", build_file, flush=True)
+
+
+def fix_font_file(font_file: str, build_file: str, patch_files: list[str] | None = None) -> str:
+    patch_files = patch_files or []
+    inputs = [font_file, *patch_files]
+    key = cache.stage_key(
+        "fonttools",
+        inputs,
+        [sys.modules[__name__], table_patch, optimize, reproducible],
+        {"optimize": optimize.POLICY, "source_date_epoch": reproducible.source_date_epoch()},
+        fontTools.version,
     )
-    return xml_parse(ttx_file_path)
+    style = splitext(basename(font_file))[0].split("-")[-1]
+    with telemetry.stage("fonttools", style, inputs, [build_file]) as record:
+        if cache.restore(key, [build_file]):
+            record.cached = True
+            return build_file
+
+        # Only the patched tables are decompiled; the others are copied as is
+        with record.phase("open"):
+            font = TTFont(font_file, lazy=True, recalcBBoxes=False, recalcTimestamp=False)
+        record.glyphs_in = font["maxp"].numGlyphs
+        with record.phase("transform"):
+            for patch_file in patch_files:
+                table_patch.patch_font(font, TTFont(patch_file))
+            fix_header(font)
+            optimize.optimize_font(font)
+        record.glyphs_out = font["maxp"].numGlyphs
+        with record.phase("generate"):
+            font.save(build_file)
+        font.close()
+
+        cache.store(key, [build_file])
+    return build_file
 
 
-def fix_post_table(xml: ElementTree) -> None:
-    # isFixedPitchを編集
-    # タグ形式: <isFixedPitch value="1"/>
-    is_fixed_pitch = 1
-    for elem in xml.iter("isFixedPitch"):
-        elem.set("value", str(is_fixed_pitch))
+def fix_header(font: TTFont, fixes: dict[str, dict[str, int]] = HEADER_FIXES) -> None:
+    for tag, fields in fixes.items():
+        table = font[tag]
+        for name, value in fields.items():
+            setattr(table, name, value)
+    # The merged font may come from the stage cache of an earlier commit
+    timestamp = reproducible.head_timestamp()
+    if timestamp is not None:
+        font["head"].created = timestamp
+        font["head"].modified = timestamp
 
 
 if __name__ == "__main__":
@@ -0,0 +1,105 @@
+import os
+import sys
+import json
+from os.path import basename, exists, splitext
+from typing import Final
+from fontTools.ttLib import TTFont
+from fontTools.ttLib.tables._c_m_a_p import CmapSubtable
+
+# Output size optimization of the built fonts, and a per-table size report.
+#
+# `optimize_font()` is applied by main.py to every font:
+#   - tables only the build tools use (fontforge's FFTM and PfEd, ttfautohint's
+#     TTFA, BDF and TeX) and the DSIG signature (POLICY["drop_tables"]) are
+#     dropped.  The device metrics tables hdmx, LTSH and VDMX, which Windows
+#     GDI reads, are not listed: the built fonts never have them, because
+#     table_patch.py refuses to patch fonts with them.
+#   - cmap is rebuilt with only a Windows BMP format 4 subtable and, when
+#     codepoints beyond the BMP (e.g. the Nerd Fonts 0xf0001+ icons) are
+#     mapped, a format 12 subtable; the legacy Mac and duplicate Unicode
+#     platform subtables are dropped, variation sequences (format 14) kept
+#   - post is written as format POLICY["post_format"]; format 3 drops the
+#     glyph names (AGAVEJP_POST_FORMAT=3)
+#
+#   optimize.py REPORT_FILE FONT [FONT ...]
+# prints the bytes per table of each font, with the change since the last
+# report, and saves the report to REPORT_FILE.
+
+POLICY: Final = {
+    "drop_tables": ["DSIG", "FFTM", "TTFA", "PfEd", "BDF ", "TeX "],
+    "post_format": float(os.environ.get("AGAVEJP_POST_FORMAT", "2")),
+}
+
+UNICODE_BMP_MAX = 0xffff
+
+
+def main() -> None:
+    if len(sys.argv) < 3:
+        raise ValueError("Invalid argument")
+    report_file = sys.argv[1]
+    font_files = sys.argv[2:]
+
+    previous = {}
+    if exists(report_file):
+        with open(report_file) as f:
+            previous = json.load(f)
+    report = {splitext(basename(font_file))[0]: table_sizes(font_file) for font_file in font_files}
+    print(format_report(report, previous))
+    with open(report_file, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+def optimize_font(font: TTFont, policy: dict = POLICY) -> None:
+    for tag in policy["drop_tables"]:
+        if tag in font:
+            del font[tag]
+    rebuild_cmap(font)
+    if font["post"].formatType != policy["post_format"]:
+        font["post"].formatType = policy["post_format"]
+
+
+def rebuild_cmap(font: TTFont) -> None:
+    cmap = font["cmap"]
+    mapping = font.getBestCmap()
+    variation_sequences = [table for table in cmap.tables if table.format == 14]
+
+    bmp = CmapSubtable.newSubtable(4)
+    bmp.platformID, bmp.platEncID, bmp.language = 3, 1, 0
+    bmp.cmap = {cp: name for cp, name in mapping.items() if cp <= UNICODE_BMP_MAX}
+    tables = [bmp]
+    if any(cp > UNICODE_BMP_MAX for cp in mapping):
+        full = CmapSubtable.newSubtable(12)
+        full.platformID, full.platEncID, full.language = 3, 10, 0
+        full.cmap = dict(mapping)
+        tables.append(full)
+    cmap.tables = tables + variation_sequences
+    cmap.tables.sort(key=lambda table: (table.platformID, table.platEncID))
+
+
+def table_sizes(font_file: str) -> dict[str, int]:
+    # tag -> bytes in the file, and the file size as "total"
+    font = TTFont(font_file, lazy=True)
+    sizes = {tag: font.reader.tables[tag].length for tag in sorted(font.reader.keys())}
+    font.close()
+    sizes["total"] = os.path.getsize(font_file)
+    return sizes
+
+
+def format_report(report: dict[str, dict[str, int]], previous: dict[str, dict[str, int]] | None = None) -> str:
+    previous = previous or {}
+    lines = []
+    for font, sizes in report.items():
+        before = previous.get(font, {})
+        lines.append(f"{font}:")
+        for tag, size in sorted(sizes.items(), key=lambda item: (item[0] == "total", -item[1])):
+            delta = ""
+            if tag in before and before[tag] != size:
+                delta = f"  ({size - before[tag]:+,})"
+            lines.append(f"  {tag:<6} {size:>12,}{delta}")
+        for tag in sorted(before.keys() - sizes.keys()):
+            lines.append(f"  {tag:<6} {'dropped':>12}  ({-before[tag]:+,})")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    main()
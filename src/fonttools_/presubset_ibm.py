@@ -0,0 +1,147 @@
+import sys
+from os.path import join, dirname, basename, splitext
+import fontTools
+from fontTools import subset
+from fontTools.ttLib import TTFont
+
+sys.path.append(join(dirname(__file__), "..", "fontforge_"))
+import cache  # noqa: E402
+import telemetry  # noqa: E402
+import ownership  # noqa: E402
+
+# Pre-subset of IBM Plex Sans JP before modify_ibm_plex_sans_jp.py.
+#
+# Drops what the modify stage would throw away anyway, so fontforge opens a
+# smaller font: the glyphs only mapped to codepoints assigned to other
+# sources (see ownership.json), the `.rotat` glyphs, and the vertical substitutions and
+# positioning features.  Glyphs mapped to both a Hack codepoint and another
+# one, and such glyphs the kept GSUB lookups refer to (e.g. `a` of
+# `salt`), are kept with all their codepoints; the modify stage still
+# clears them like it does on the original font.
+#
+# presubset_ibm.py FONT_FILE BUILD_FILE
+
+DROPPED_FEATURES = ("halt", "vhal", "palt", "vpal", "kern", "vkrn", "vert", "vrt2")
+DROPPED_GLYPH_SUFFIXES = (".rotat",)
+
+
+def main() -> None:
+    if len(sys.argv) != 3:
+        raise ValueError("Invalid argument")
+    font_file = sys.argv[1]
+    build_file = sys.argv[2]
+
+    key = cache.stage_key(
+        "presubset_ibm",
+        [font_file],
+        [sys.modules[__name__], ownership],
+        {"ownership": ownership.foreign_ranges("ibm")},
+        fontTools.version,
+    )
+    style = splitext(basename(font_file))[0].split("-")[-1]
+    with telemetry.stage("presubset_ibm", style, [font_file], [build_file]) as record:
+        if cache.restore(key, [build_file]):
+            record.cached = True
+            print("Restored:", build_file, flush=True)
+            return
+
+        with record.phase("open"):
+            font = TTFont(font_file)
+        record.glyphs_in = font["maxp"].numGlyphs
+        with record.phase("transform"):
+            presubset(font)
+        record.glyphs_out = font["maxp"].numGlyphs
+        with record.phase("generate"):
+            font.save(build_file)
+        font.close()
+        cache.store(key, [build_file])
+    print("Generated:", build_file, flush=True)
+
+
+def presubset(font: TTFont) -> None:
+    codepoints: dict[str, list[int]] = {}
+    for codepoint, name in font.getBestCmap().items():
+        codepoints.setdefault(name, []).append(codepoint)
+
+    features = set()
+    for tag in ("GSUB", "GPOS"):
+        if tag in font:
+            features.update(record.FeatureTag for record in font[tag].table.FeatureList.FeatureRecord)
+    kept_features = features.difference(DROPPED_FEATURES)
+    referenced = layout_glyphs(font, kept_features)
+
+    foreign = ownership.foreign_ranges("ibm")
+
+    def is_foreign(codepoint: int) -> bool:
+        return any(start <= codepoint <= end for start, end in foreign)
+
+    glyphs = []
+    unicodes = []
+    for name in font.getGlyphOrder():
+        if name.endswith(DROPPED_GLYPH_SUFFIXES):
+            continue
+        mapped = codepoints.get(name, [])
+        if mapped and all(is_foreign(codepoint) for codepoint in mapped) and name not in referenced:
+            continue
+        glyphs.append(name)
+        unicodes.extend(mapped)
+
+    options = subset.Options()
+    options.layout_features = sorted(kept_features)
+    options.layout_scripts = ["*"]
+    # The kept glyphs are listed explicitly; the closure would bring the
+    # `.rotat` glyphs back through `aalt`
+    options.layout_closure = False
+    options.glyph_names = True
+    options.name_IDs = ["*"]
+    options.name_languages = ["*"]
+    options.name_legacy = True
+    options.legacy_kern = True
+    options.notdef_glyph = True
+    options.notdef_outline = True
+    options.hinting = True
+    options.recalc_bounds = False
+    options.prune_unicode_ranges = False
+    options.prune_codepage_ranges = False
+    options.drop_tables = ["DSIG"]
+    options.passthrough_tables = True
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(glyphs=glyphs, unicodes=unicodes)
+    subsetter.subset(font)
+
+
+def layout_glyphs(font: TTFont, features: set[str]) -> set[str]:
+    # Glyphs the lookups of `features` refer to (coverage, substitutions,
+    # ligature components, classes)
+    names = set(font.getGlyphOrder())
+    found: set[str] = set()
+
+    def collect(value) -> None:
+        if isinstance(value, str):
+            if value in names:
+                found.add(value)
+        elif isinstance(value, dict):
+            for key, item in value.items():
+                collect(key)
+                collect(item)
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                collect(item)
+        elif hasattr(value, "__dict__"):
+            for item in vars(value).values():
+                collect(item)
+
+    for tag in ("GSUB", "GPOS"):
+        if tag not in font:
+            continue
+        table = font[tag].table
+        indices = {index
+                   for record in table.FeatureList.FeatureRecord if record.FeatureTag in features
+                   for index in record.Feature.LookupListIndex}
+        for index in sorted(indices):
+            collect(table.LookupList.Lookup[index])
+    return found
+
+
+if __name__ == "__main__":
+    main()
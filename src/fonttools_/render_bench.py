@@ -0,0 +1,217 @@
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+from os import makedirs
+from os.path import join, dirname, abspath, basename, splitext, exists
+from concurrent.futures import ProcessPoolExecutor
+import freetype
+
+sys.path.append(join(dirname(__file__), "..", "fontforge_"))
+import properties as P  # noqa: E402
+
+# FreeType benchmark of the built fonts.
+#
+# Every style is opened with FreeType and, for the characters of each sample
+# text in images/text, the cmap lookups and the glyph load + rasterization
+# are timed at common terminal pixel sizes, hinted (the font's TrueType
+# instructions) and unhinted.  Glyphs are loaded without a glyph cache, like
+# the first screen a terminal draws.  The results are saved with the version
+# and commit so runs can be compared across releases (--compare).
+#
+# With --render DIR, the sample texts are also rendered to PNG files (one
+# per text and style) in parallel; this needs Pillow.
+
+ROOT_DIR = abspath(join(dirname(__file__), "..", ".."))
+TEXT_DIR = join(ROOT_DIR, "images", "text")
+TEXT_FILES = ("eisuu.txt", "kana.txt", "kanji.txt", "cpp.txt", "rust.txt", "nerdfonts.txt")
+STYLES = ("Regular", "Bold", "Italic", "BoldItalic")
+PIXEL_SIZES = (12, 14, 16, 20, 24)
+LOAD_MODES = {
+    "hinted": freetype.FT_LOAD_DEFAULT,
+    "unhinted": freetype.FT_LOAD_NO_HINTING,
+}
+OPEN_REPEAT = 20
+RENDER_PIXEL_SIZE = 16
+RENDER_MARGIN = 8
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark FreeType loading and rasterization of the built fonts")
+    parser.add_argument("build_dir")
+    parser.add_argument("--output", default=join(ROOT_DIR, ".cache", "render-bench", "results.json"),
+                        help="results file (default: %(default)s)")
+    parser.add_argument("--compare", metavar="RESULTS", help="results of an earlier run to compare with")
+    parser.add_argument("--sizes", default=",".join(map(str, PIXEL_SIZES)), help="pixel sizes (default: %(default)s)")
+    parser.add_argument("--render", metavar="DIR", help="also render the sample texts to PNG files in DIR")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    texts = load_texts()
+    font_files = [join(args.build_dir, f"{P.FAMILY}-{style}.ttf") for style in STYLES]
+    font_files = [font_file for font_file in font_files if exists(font_file)]
+    if not font_files:
+        raise ValueError("No fonts in:", args.build_dir)
+
+    results = {
+        "version": P.VERSION,
+        "commit": git_commit(),
+        "sizes": sizes,
+        "fonts": {splitext(basename(font_file))[0]: benchmark_font(font_file, texts, sizes)
+                  for font_file in font_files},
+    }
+    makedirs(dirname(abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print(report(results, baseline))
+
+    if args.render:
+        makedirs(args.render, exist_ok=True)
+        with ProcessPoolExecutor() as executor:
+            jobs = [executor.submit(render_text, font_file, name, text, args.render)
+                    for font_file in font_files for name, text in texts.items()]
+            for job in jobs:
+                print("Rendered:", job.result(), flush=True)
+
+
+def load_texts() -> dict[str, str]:
+    texts = {}
+    for filename in TEXT_FILES:
+        with open(join(TEXT_DIR, filename), encoding="utf-8") as f:
+            texts[splitext(filename)[0]] = f.read()
+    return texts
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT_DIR, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark_font(font_file: str, texts: dict[str, str], sizes: list[int]) -> dict:
+    open_times = []
+    for _ in range(OPEN_REPEAT):
+        start = time.perf_counter()
+        face = freetype.Face(font_file)
+        open_times.append(time.perf_counter() - start)
+        del face
+
+    face = freetype.Face(font_file)
+    result: dict = {"open_ms": statistics.median(open_times) * 1000, "texts": {}}
+    for name, text in texts.items():
+        chars = sorted({c for c in text if not c.isspace()})
+        # Includes the Python call overhead, which is the same across builds
+        start = time.perf_counter()
+        indices = [face.get_char_index(c) for c in chars]
+        cmap_time = time.perf_counter() - start
+        glyphs = [index for index in indices if index != 0]
+
+        text_result = {
+            "chars": len(chars),
+            "missing": len(chars) - len(glyphs),
+            "cmap_ns": cmap_time / max(1, len(chars)) * 1e9,
+            "load_us": {},
+        }
+        for size in sizes:
+            face.set_pixel_sizes(0, size)
+            text_result["load_us"][str(size)] = {
+                mode: load_time(face, glyphs, flags) for mode, flags in LOAD_MODES.items()
+            }
+        result["texts"][name] = text_result
+    return result
+
+
+def load_time(face: freetype.Face, glyphs: list[int], flags: int) -> dict[str, float]:
+    # Mean and 95th percentile of loading and rasterizing one glyph, in us
+    times = []
+    for index in glyphs:
+        start = time.perf_counter()
+        face.load_glyph(index, flags | freetype.FT_LOAD_RENDER)
+        times.append(time.perf_counter() - start)
+    if not times:
+        return {"mean": 0.0, "p95": 0.0}
+    times.sort()
+    return {
+        "mean": statistics.mean(times) * 1e6,
+        "p95": times[max(0, int(len(times) * 0.95) - 1)] * 1e6,
+    }
+
+
+def report(results: dict, baseline: dict | None = None) -> str:
+    lines = []
+    for font, font_result in results["fonts"].items():
+        base = (baseline or {}).get("fonts", {}).get(font)
+        header = f"{font}: open {font_result['open_ms']:.2f} ms"
+        if base:
+            header += f" ({change(font_result['open_ms'], base['open_ms'])})"
+        lines.append(header)
+        lines.append(f"  {'text':<10} {'mode':<9} {'cmap[ns]':>9} "
+                     + " ".join(f"{str(size) + 'px[us]':>10}" for size in results["sizes"]))
+        for name, text_result in font_result["texts"].items():
+            base_text = (base or {}).get("texts", {}).get(name)
+            for mode in LOAD_MODES:
+                cells = []
+                for size in results["sizes"]:
+                    mean = text_result["load_us"][str(size)][mode]["mean"]
+                    cell = f"{mean:.1f}"
+                    base_load = (base_text or {}).get("load_us", {}).get(str(size))
+                    if base_load:
+                        cell += f"({change(mean, base_load[mode]['mean'])})"
+                    cells.append(f"{cell:>10}")
+                cmap = f"{text_result['cmap_ns']:.0f}" if mode == "hinted" else ""
+                lines.append(f"  {name:<10} {mode:<9} {cmap:>9} " + " ".join(cells))
+            if text_result["missing"]:
+                lines.append(f"  {name:<10} missing glyphs: {text_result['missing']} of {text_result['chars']}")
+    return "\n".join(lines)
+
+
+def change(value: float, base: float) -> str:
+    return f"{(value / base - 1) * 100:+.0f}%" if base else "-"
+
+
+def render_text(font_file: str, name: str, text: str, render_dir: str) -> str:
+    from PIL import Image
+
+    face = freetype.Face(font_file)
+    face.set_pixel_sizes(0, RENDER_PIXEL_SIZE)
+    ascender = face.size.ascender >> 6
+    line_height = face.size.height >> 6
+    lines = text.expandtabs(4).splitlines() or [""]
+
+    # Advance widths first, to size the image
+    advances: dict[str, int] = {}
+    for c in set(text):
+        face.load_char(c, freetype.FT_LOAD_DEFAULT)
+        advances[c] = face.glyph.advance.x >> 6
+    width = max(sum(advances.get(c, 0) for c in line) for line in lines) + RENDER_MARGIN * 2
+    height = line_height * len(lines) + RENDER_MARGIN * 2
+
+    image = Image.new("L", (max(1, width), height), 255)
+    for row, line in enumerate(lines):
+        x = RENDER_MARGIN
+        baseline = RENDER_MARGIN + row * line_height + ascender
+        for c in line:
+            face.load_char(c, freetype.FT_LOAD_RENDER)
+            bitmap = face.glyph.bitmap
+            if bitmap.width and bitmap.rows:
+                glyph = Image.frombytes("L", (bitmap.width, bitmap.rows), bytes(bitmap.buffer))
+                position = (x + face.glyph.bitmap_left, baseline - face.glyph.bitmap_top)
+                image.paste(0, position, glyph)
+            x += advances[c]
+
+    png_file = join(render_dir, f"{splitext(basename(font_file))[0]}-{name}.png")
+    image.save(png_file, optimize=True)
+    return png_file
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import sys
+import json
+import time
+import random
+import threading
+import statistics
+from os.path import join, dirname
+from urllib.parse import quote
+from urllib.request import urlopen
+from concurrent.futures import ThreadPoolExecutor
+from subset_server import SubsetServer
+
+# Benchmark of the subset server under concurrent requests.
+#
+# A server is started on the build directory and CLIENTS threads request
+# REQUESTS subsets.  The requested "pages" are drawn from PAGES texts made
+# of the characters in images/text with a Zipf-like popularity, so popular
+# pages hit the cache like they would in a browser session.
+#
+# subset_bench.py BUILD_DIR [REQUESTS] [CLIENTS]
+
+TEXT_DIR = join(dirname(__file__), "..", "..", "images", "text")
+TEXT_FILES = ("eisuu.txt", "kana.txt", "kanji.txt", "cpp.txt", "rust.txt")
+STYLES = ("Regular", "Bold", "Italic", "BoldItalic")
+PAGES = 50
+PAGE_LENGTH = 400
+SEED = 0
+
+
+def main() -> None:
+    if len(sys.argv) not in (2, 3, 4):
+        raise ValueError("Invalid argument")
+    build_dir = sys.argv[1]
+    requests = int(sys.argv[2]) if len(sys.argv) >= 3 else 400
+    clients = int(sys.argv[3]) if len(sys.argv) == 4 else 8
+
+    server = SubsetServer(("127.0.0.1", 0), build_dir)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        result = run(f"http://127.0.0.1:{server.server_port}", requests, clients)
+    finally:
+        server.shutdown()
+        server.server_close()
+    print(json.dumps(result, indent=2))
+
+
+def make_pages(count: int = PAGES, length: int = PAGE_LENGTH) -> list[str]:
+    chars = []
+    for filename in TEXT_FILES:
+        with open(join(TEXT_DIR, filename), encoding="utf-8") as f:
+            chars.extend(c for c in f.read() if not c.isspace())
+    rng = random.Random(SEED)
+    return ["".join(rng.sample(chars, min(length, len(chars)))) for _ in range(count)]
+
+
+def run(url: str, requests: int, clients: int) -> dict:
+    pages = make_pages()
+    rng = random.Random(SEED)
+    weights = [1 / (rank + 1) for rank in range(len(pages))]
+    jobs = [(rng.choice(STYLES), rng.choices(pages, weights)[0]) for _ in range(requests)]
+
+    def fetch(job: tuple[str, str]) -> tuple[float, int]:
+        style, text = job
+        start = time.perf_counter()
+        with urlopen(f"{url}/AgaveJP-{style}.woff2?text={quote(text)}") as response:
+            size = len(response.read())
+        return time.perf_counter() - start, size
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as executor:
+        results = list(executor.map(fetch, jobs))
+    elapsed = time.perf_counter() - start
+
+    with urlopen(f"{url}/stats") as response:
+        stats = json.load(response)
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        "requests": requests,
+        "clients": clients,
+        "elapsed": elapsed,
+        "requests_per_second": requests / elapsed,
+        "latency_p50_ms": statistics.median(latencies) * 1000,
+        "latency_p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "latency_max_ms": latencies[-1] * 1000,
+        "mean_subset_kb": statistics.mean(size for _, size in results) / 1024,
+        "cache": stats,
+    }
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+import os
+import re
+import sys
+import json
+import hashlib
+import threading
+from io import BytesIO
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os.path import join, exists, getmtime
+from urllib.parse import urlparse, parse_qs
+from fontTools import subset
+from fontTools.ttLib import TTFont
+
+# On-demand WOFF2 subsets of the built fonts.
+#
+#   GET /AgaveJP-<style>.woff2?unicodes=U+20-7E,U+3042&text=...
+#   GET /stats
+#
+# The requested codepoints (`unicodes` ranges and/or the characters of
+# `text`) are intersected with the cmap of the font, without expanding the
+# ranges, and normalized into sorted ranges.  The subsets are kept in an
+# LRU cache keyed by that and the digest of the font file, so a rebuilt font
+# never serves stale subsets.  Subsets are generated in a process pool;
+# concurrent requests for the same subset wait for one generation.
+#
+# subset_server.py BUILD_DIR [PORT]
+
+DEFAULT_PORT = 8357
+CACHE_SIZE_LIMIT = int(os.environ.get("AGAVEJP_SUBSET_CACHE_SIZE", "256")) * 1024 * 1024
+MAX_CODEPOINTS = 0x10ffff
+
+FONT_PATH = re.compile(r"^/([A-Za-z0-9]+-[A-Za-z]+)\.woff2$")
+
+
+def main() -> None:
+    if len(sys.argv) not in (2, 3):
+        raise ValueError("Invalid argument")
+    build_dir = sys.argv[1]
+    port = int(sys.argv[2]) if len(sys.argv) == 3 else DEFAULT_PORT
+
+    server = SubsetServer(("", port), build_dir)
+    print(f"Serving: {build_dir} on http://localhost:{server.server_port}/", flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def parse_unicodes(spec: str) -> list[tuple[int, int]]:
+    ranges = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        start, _, end = item.upper().removeprefix("U+").partition("-")
+        first, last = int(start, 16), int(end or start, 16)
+        if not 0 <= first <= last <= MAX_CODEPOINTS:
+            raise ValueError("Invalid range:", item)
+        ranges.append((first, last))
+    return ranges
+
+
+def intersect(ranges: list[tuple[int, int]], codepoints: list[int]) -> set[int]:
+    # Codepoints of the sorted `codepoints` within `ranges`.  Overlapping
+    # ranges are merged first, so each codepoint is visited once.
+    merged: list[list[int]] = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    result: set[int] = set()
+    for first, last in merged:
+        result.update(codepoints[bisect_left(codepoints, first):bisect_right(codepoints, last)])
+    return result
+
+
+def normalize(codepoints: set[int]) -> str:
+    # Canonical form of a codepoint set: sorted, merged hex ranges
+    ranges: list[list[int]] = []
+    for codepoint in sorted(codepoints):
+        if ranges and ranges[-1][1] == codepoint - 1:
+            ranges[-1][1] = codepoint
+        else:
+            ranges.append([codepoint, codepoint])
+    return ",".join(f"{start:x}" if start == end else f"{start:x}-{end:x}" for start, end in ranges)
+
+
+class SubsetCache:
+    def __init__(self, size_limit: int = CACHE_SIZE_LIMIT) -> None:
+        self.size_limit = size_limit
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+        self._pending: dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str, generate) -> bytes:
+        # `generate()` returns a Future of the subset; it is only called
+        # when the subset is neither cached nor being generated
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            future = self._pending.get(key)
+            if future is None:
+                self.misses += 1
+                future = self._pending[key] = generate()
+            else:
+                self.hits += 1
+        try:
+            data = future.result()
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = data
+                self.size += len(data)
+                while self.size > self.size_limit and len(self._entries) > 1:
+                    _, evicted = self._entries.popitem(last=False)
+                    self.size -= len(evicted)
+        return data
+
+    def stats(self) -> dict:
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "size": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0.0,
+            }
+
+
+class SubsetServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], build_dir: str, workers: int | None = None) -> None:
+        super().__init__(address, SubsetHandler)
+        self.build_dir = build_dir
+        self.cache = SubsetCache()
+        self.pool = ProcessPoolExecutor(workers)
+        self._digests: dict[str, tuple[float, str]] = {}
+        self._codepoints: dict[str, list[int]] = {}
+        self._digest_lock = threading.Lock()
+
+    def font_digest(self, font_file: str) -> str:
+        # Rehashed when the font is rebuilt
+        mtime = getmtime(font_file)
+        with self._digest_lock:
+            cached = self._digests.get(font_file)
+            if cached and cached[0] == mtime:
+                return cached[1]
+        h = hashlib.sha256()
+        with open(font_file, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        with self._digest_lock:
+            self._digests[font_file] = (mtime, h.hexdigest())
+        return h.hexdigest()
+
+    def font_codepoints(self, font_file: str, digest: str) -> list[int]:
+        # Sorted codepoints of the cmap of the font with `digest`
+        with self._digest_lock:
+            if digest in self._codepoints:
+                return self._codepoints[digest]
+        font = TTFont(font_file, lazy=True)
+        codepoints = sorted(font.getBestCmap())
+        font.close()
+        with self._digest_lock:
+            self._codepoints[digest] = codepoints
+        return codepoints
+
+    def subset(self, font_name: str, ranges: list[tuple[int, int]]) -> bytes:
+        font_file = join(self.build_dir, font_name + ".ttf")
+        digest = self.font_digest(font_file)
+        codepoints = intersect(ranges, self.font_codepoints(font_file, digest))
+        key = hashlib.sha256(f"{digest}:{normalize(codepoints)}".encode("utf-8")).hexdigest()
+        return self.cache.get(key, lambda: self.pool.submit(make_subset, font_file, sorted(codepoints)))
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.pool.shutdown()
+
+
+class SubsetHandler(BaseHTTPRequestHandler):
+    server: SubsetServer
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        if url.path == "/stats":
+            self._send(200, "application/json", json.dumps(self.server.cache.stats()).encode("utf-8"))
+            return
+
+        match = FONT_PATH.match(url.path)
+        if match is None or not exists(join(self.server.build_dir, match.group(1) + ".ttf")):
+            self._send(404, "text/plain", b"Not found")
+            return
+        query = parse_qs(url.query)
+        try:
+            ranges = parse_unicodes(",".join(query.get("unicodes", [])))
+        except ValueError:
+            self._send(400, "text/plain", b"Invalid unicodes")
+            return
+        ranges.extend((ord(c), ord(c)) for c in set("".join(query.get("text", []))))
+        if not ranges:
+            self._send(400, "text/plain", b"No codepoints requested")
+            return
+
+        try:
+            data = self.server.subset(match.group(1), ranges)
+        except Exception as e:
+            self._send(500, "text/plain", str(e).encode("utf-8"))
+            return
+        self._send(200, "font/woff2", data, cache_control="public, max-age=86400")
+
+    def _send(self, status: int, content_type: str, body: bytes, cache_control: str = "no-store") -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", cache_control)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+# Font file contents per worker process: path -> (mtime, bytes)
+_font_data: dict[str, tuple[float, bytes]] = {}
+
+
+def make_subset(font_file: str, codepoints: list[int]) -> bytes:
+    mtime = getmtime(font_file)
+    if font_file not in _font_data or _font_data[font_file][0] != mtime:
+        with open(font_file, "rb") as f:
+            _font_data[font_file] = (mtime, f.read())
+
+    options = subset.Options()
+    options.flavor = "woff2"
+    options.notdef_outline = True
+    font = TTFont(BytesIO(_font_data[font_file][1]))
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(unicodes=codepoints)
+    subsetter.subset(font)
+    out = BytesIO()
+    font.save(out)
+    font.close()
+    return out.getvalue()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import copy
+from fontTools.ttLib import TTFont
+from fontTools.ttLib.tables._c_m_a_p import CmapSubtable
+
+# Table-level patching of the merged fonts.
+#
+# The glyphs of the patch fonts (NerdFonts.ttf, Braille.ttf) are appended to
+# the glyph order with their outlines, metrics, names and cmap entries.  The
+# glyphs of the base font stay compiled as they are (outlines and hinting
+# programs are not decoded or re-encoded), and like `font.mergeFonts()`
+# codepoints the base font already maps are not patched.
+
+# Tables with per-glyph data this module does not extend
+UNSUPPORTED_TABLES = ("CFF ", "CFF2", "gvar", "vmtx", "hdmx", "LTSH", "VDMX")
+
+MAXP_FIELDS = (
+    "maxPoints", "maxContours", "maxCompositePoints", "maxCompositeContours",
+    "maxComponentElements", "maxComponentDepth", "maxSizeOfInstructions",
+)
+
+
+def patch_font(font: TTFont, patch: TTFont) -> int:
+    # Append the glyphs of `patch` to `font`.  Returns the number of glyphs added.
+    for tag in UNSUPPORTED_TABLES:
+        if tag in font or tag in patch:
+            raise ValueError("Unsupported table for patching:", tag)
+    if font["head"].unitsPerEm != patch["head"].unitsPerEm:
+        raise ValueError("unitsPerEm differs:", font["head"].unitsPerEm, patch["head"].unitsPerEm)
+
+    # Load everything indexed by glyph before the glyph order changes
+    glyph_order = font.getGlyphOrder()
+    glyf = font["glyf"]
+    hmtx = font["hmtx"]
+    cmap = font["cmap"]
+    base_cmap = font.getBestCmap()
+
+    patch_glyf = patch["glyf"]
+    patch_cmap = patch.getBestCmap()
+    codepoints = {cp: name for cp, name in patch_cmap.items() if cp not in base_cmap}
+    if not codepoints:
+        return 0
+
+    # Glyphs to add, with the components of composite glyphs
+    names: list[str] = []
+    pending = sorted(set(codepoints.values()), key=patch.getGlyphID)
+    seen = set(pending)
+    while pending:
+        name = pending.pop(0)
+        names.append(name)
+        for component in patch_glyf[name].getComponentNames(patch_glyf):
+            if component not in seen:
+                seen.add(component)
+                pending.append(component)
+
+    existing = set(glyph_order)
+    renames: dict[str, str] = {}
+    for name in names:
+        new_name = name
+        i = 1
+        while new_name in existing:
+            new_name = f"{name}.{i}"
+            i += 1
+        existing.add(new_name)
+        renames[name] = new_name
+
+    for name in names:
+        glyph = copy.deepcopy(patch_glyf[name])
+        if glyph.isComposite():
+            for component in glyph.components:
+                component.glyphName = renames[component.glyphName]
+        glyf.glyphs[renames[name]] = glyph
+        hmtx.metrics[renames[name]] = patch["hmtx"][name]
+    font.setGlyphOrder(glyph_order + [renames[name] for name in names])
+    glyf.glyphOrder = font.getGlyphOrder()
+
+    _add_cmap(cmap, {cp: renames[name] for cp, name in codepoints.items()})
+    _update_maxp(font, patch)
+    _update_bounds(font, [renames[name] for name in names])
+    _update_os2(font)
+    return len(names)
+
+
+def _add_cmap(cmap, mapping: dict[int, str]) -> None:
+    subtables = [t for t in cmap.tables if t.isUnicode() and t.format in (4, 12)]
+    if any(cp > 0xffff for cp in mapping) and not any(t.format == 12 for t in subtables):
+        bmp = next(t for t in subtables if t.format == 4)
+        full = CmapSubtable.newSubtable(12)
+        full.platformID, full.platEncID, full.language = 3, 10, 0
+        full.cmap = dict(bmp.cmap)
+        cmap.tables.append(full)
+        subtables.append(full)
+    for table in subtables:
+        for cp, name in mapping.items():
+            if table.format == 12 or cp <= 0xffff:
+                table.cmap.setdefault(cp, name)
+
+
+def _update_maxp(font: TTFont, patch: TTFont) -> None:
+    # The glyphs are copied unchanged, so the maximums of both fonts bound them
+    maxp = font["maxp"]
+    patch_maxp = patch["maxp"]
+    for field in MAXP_FIELDS:
+        if hasattr(maxp, field) and hasattr(patch_maxp, field):
+            setattr(maxp, field, max(getattr(maxp, field), getattr(patch_maxp, field)))
+    maxp.numGlyphs = len(font.getGlyphOrder())
+
+
+def _update_bounds(font: TTFont, names: list[str]) -> None:
+    glyf = font["glyf"]
+    hmtx = font["hmtx"]
+    head = font["head"]
+    hhea = font["hhea"]
+    for name in names:
+        glyph = glyf[name]
+        glyph.recalcBounds(glyf)
+        advance, lsb = hmtx[name]
+        hhea.advanceWidthMax = max(hhea.advanceWidthMax, advance)
+        if glyph.numberOfContours == 0:
+            continue
+        head.xMin = min(head.xMin, glyph.xMin)
+        head.yMin = min(head.yMin, glyph.yMin)
+        head.xMax = max(head.xMax, glyph.xMax)
+        head.yMax = max(head.yMax, glyph.yMax)
+        extent = lsb + glyph.xMax - glyph.xMin
+        hhea.minLeftSideBearing = min(hhea.minLeftSideBearing, lsb)
+        hhea.minRightSideBearing = min(hhea.minRightSideBearing, advance - extent)
+        hhea.xMaxExtent = max(hhea.xMaxExtent, extent)
+
+
+def _update_os2(font: TTFont) -> None:
+    os2 = font["OS/2"]
+    codepoints = font.getBestCmap().keys()
+    os2.usFirstCharIndex = min(0xffff, min(codepoints))
+    os2.usLastCharIndex = min(0xffff, max(codepoints))
+    os2.recalcUnicodeRanges(font)
@@ -0,0 +1,207 @@
+import sys
+from io import BytesIO
+from os import makedirs
+from os.path import join, dirname, basename
+from concurrent.futures import ProcessPoolExecutor
+from typing import Final
+import fontTools
+from fontTools import subset
+from fontTools.ttLib import TTFont
+
+sys.path.append(join(dirname(__file__), "..", "fontforge_"))
+import cache  # noqa: E402
+import telemetry  # noqa: E402
+import properties as P  # noqa: E402
+
+# WOFF2 shards of the built fonts for the web.
+#
+# Every style is split by codepoint into a Latin/symbols shard (including
+# the Nerd Fonts icons), a kana/CJK punctuation shard and kanji shards in
+# frequency order, and a stylesheet with one @font-face per shard and its
+# unicode-range is written next to them.  Browsers only download the shards
+# the characters of a page fall into.
+#
+# Kanji are ordered by a frequency list (a text file whose characters are in
+# descending order of frequency; lines starting with # are ignored), and then
+# by JIS X 0208 level 1, level 2 and the rest.  The default list,
+# resources/kanji-order.txt, puts the kyoiku kanji first by grade and the
+# other joyo kanji after them, so they fill kanji1 and kanji2.
+#
+# webfont.py BUILD_DIR WEB_DIR STYLE [STYLE ...] [--frequency FILE]
+
+KANA_RANGES: Final = [
+    (0x3000, 0x30ff),  # CJK symbols and punctuation, hiragana, katakana
+    (0x31f0, 0x31ff),  # katakana phonetic extensions
+    (0x3200, 0x33ff),  # enclosed CJK letters, CJK compatibility
+    (0xff00, 0xffef),  # halfwidth and fullwidth forms
+]
+KANJI_RANGES: Final = [
+    (0x2e80, 0x2fdf),    # radicals
+    (0x3400, 0x4dbf),    # extension A
+    (0x4e00, 0x9fff),    # unified ideographs
+    (0xf900, 0xfaff),    # compatibility ideographs
+    (0x20000, 0x3ffff),  # supplementary planes
+]
+# Kanji per shard (kyoiku, other joyo, JIS level 1 remainder); the last shard
+# takes the rest
+KANJI_SHARD_SIZES: Final = (1026, 1110, 1500, 3000)
+DEFAULT_FREQUENCY_FILE: Final = join(dirname(__file__), "..", "..", "resources", "kanji-order.txt")
+
+CSS_FILE: Final = P.FAMILY + ".css"
+
+
+def main() -> None:
+    args = sys.argv[1:]
+    frequency_file = DEFAULT_FREQUENCY_FILE
+    if "--frequency" in args:
+        i = args.index("--frequency")
+        if i + 1 >= len(args):
+            raise ValueError("Invalid argument")
+        frequency_file = args[i + 1]
+        args = args[:i] + args[i + 2:]
+    if len(args) < 3:
+        raise ValueError("Invalid argument")
+    build_dir, web_dir, styles = args[0], args[1], args[2:]
+    makedirs(web_dir, exist_ok=True)
+
+    kanji_order = load_kanji_order(frequency_file)
+    font_files = [join(build_dir, f"{P.FAMILY}-{style}.ttf") for style in styles]
+    shards = [split_shards(font_file, kanji_order) for font_file in font_files]
+
+    with ProcessPoolExecutor(max_workers=len(styles)) as executor:
+        jobs = [executor.submit(build_shards, font_file, web_dir, style_shards, [frequency_file])
+                for font_file, style_shards in zip(font_files, shards)]
+        for job in jobs:
+            for shard_file in job.result():
+                print("Generated:", shard_file, flush=True)
+
+    css_file = join(web_dir, CSS_FILE)
+    with open(css_file, "w") as f:
+        f.write(stylesheet(styles, shards))
+    print("Generated:", css_file, flush=True)
+
+
+def load_kanji_order(frequency_file: str | None = None) -> list[int]:
+    order: dict[int, None] = {}
+    if frequency_file is not None:
+        with open(frequency_file, encoding="utf-8") as f:
+            for line in f:
+                if not line.startswith("#"):
+                    order.update((ord(c), None) for c in line if is_kanji(ord(c)))
+    for first_byte in range(0xb0, 0xf5):  # level 1: rows 16-47, level 2: rows 48-84
+        for second_byte in range(0xa1, 0xff):
+            try:
+                c = bytes([first_byte, second_byte]).decode("euc_jp")
+            except UnicodeDecodeError:
+                continue
+            order.setdefault(ord(c), None)
+    return list(order)
+
+
+def is_kanji(codepoint: int) -> bool:
+    return any(start <= codepoint <= end for start, end in KANJI_RANGES)
+
+
+def is_kana(codepoint: int) -> bool:
+    return any(start <= codepoint <= end for start, end in KANA_RANGES)
+
+
+def split_shards(font_file: str, kanji_order: list[int]) -> dict[str, list[int]]:
+    # shard name -> codepoints of the font in it
+    font = TTFont(font_file, lazy=True)
+    codepoints = sorted(font.getBestCmap())
+    font.close()
+
+    kanji = {cp for cp in codepoints if is_kanji(cp)}
+    ordered = [cp for cp in kanji_order if cp in kanji]
+    ordered += sorted(kanji.difference(ordered))
+
+    shards = {
+        "latin": [cp for cp in codepoints if not is_kanji(cp) and not is_kana(cp)],
+        "kana": [cp for cp in codepoints if is_kana(cp)],
+    }
+    start = 0
+    for i, size in enumerate(KANJI_SHARD_SIZES):
+        last = i == len(KANJI_SHARD_SIZES) - 1
+        part = ordered[start:] if last else ordered[start:start + size]
+        start += size
+        if part:
+            shards[f"kanji{i + 1}"] = sorted(part)
+    return {name: cps for name, cps in shards.items() if cps}
+
+
+def shard_file_name(font_file: str, shard: str) -> str:
+    return basename(font_file).removesuffix(".ttf") + f".{shard}.woff2"
+
+
+def build_shards(font_file: str, web_dir: str, shards: dict[str, list[int]], extra_inputs: list[str]) -> list[str]:
+    shard_files = [join(web_dir, shard_file_name(font_file, shard)) for shard in shards]
+    key = cache.stage_key(
+        "webfont",
+        [font_file, *extra_inputs],
+        [sys.modules[__name__]],
+        {"shards": {name: unicode_range(cps) for name, cps in shards.items()}},
+        fontTools.version,
+    )
+    style = basename(font_file).removesuffix(".ttf").split("-")[-1]
+    with telemetry.stage("webfont", style, [font_file], shard_files) as record:
+        if cache.restore(key, shard_files):
+            record.cached = True
+            return shard_files
+
+        with record.phase("open"):
+            with open(font_file, "rb") as f:
+                data = f.read()
+        with record.phase("generate"):
+            for shard_file, codepoints in zip(shard_files, shards.values()):
+                make_shard(data, codepoints, shard_file)
+        cache.store(key, shard_files)
+    return shard_files
+
+
+def make_shard(font_data: bytes, codepoints: list[int], shard_file: str) -> None:
+    options = subset.Options()
+    options.flavor = "woff2"
+    options.layout_features = ["*"]
+    options.name_IDs = ["*"]
+    options.notdef_outline = True
+    font = TTFont(BytesIO(font_data))
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(unicodes=codepoints)
+    subsetter.subset(font)
+    font.save(shard_file)
+    font.close()
+
+
+def unicode_range(codepoints: list[int]) -> str:
+    ranges: list[list[int]] = []
+    for codepoint in codepoints:
+        if ranges and ranges[-1][1] == codepoint - 1:
+            ranges[-1][1] = codepoint
+        else:
+            ranges.append([codepoint, codepoint])
+    return ", ".join(f"U+{start:X}" if start == end else f"U+{start:X}-{end:X}" for start, end in ranges)
+
+
+def stylesheet(styles: list[str], shards: list[dict[str, list[int]]]) -> str:
+    rules = []
+    for style, style_shards in zip(styles, shards):
+        weight = P.STYLE_PROPERTY[style]["os2_weight"]
+        font_style = "italic" if "Italic" in style else "normal"
+        font_file = f"{P.FAMILY}-{style}.ttf"
+        for shard, codepoints in style_shards.items():
+            rules.append("\n".join([
+                "@font-face {",
+                f'  font-family: "{P.FAMILY}";',
+                f'  src: url("{shard_file_name(font_file, shard)}") format("woff2");',
+                f"  font-weight: {weight};",
+                f"  font-style: {font_style};",
+                "  font-display: swap;",
+                f"  unicode-range: {unicode_range(codepoints)};",
+                "}",
+            ]))
+    return "\n\n".join(rules) + "\n"
+
+
+if __name__ == "__main__":
+    main()